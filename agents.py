@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Multi-agent pipelines for DataSenderApp
+Named agent roles (a consultant and a coder by default) each run on their
+own CLI process and publish to their own event channel: every event is
+tagged with its `agent`, so the page can render the agents side by side,
+or subscribe to one of them with /events?agent=coder. In handoff mode an
+agent's answer is passed to the next agent on the server the moment it
+finishes, with no browser round trip. In parallel mode independent agents
+work on the same message at the same time.
+"""
+
+import threading
+
+import tracing
+from event_bus import SessionChannel
+
+# Prompt templates per role: {message} is the user's message, {previous}
+# the answer of the agent before it in a handoff
+ROLES = {
+    'consultant': {
+        'prompt': "You are the consultant. Plan the approach, architecture and trade-offs "
+                  "for the request below. Do not write the code.\n\n{message}",
+    },
+    'coder': {
+        'prompt': "You are the coder. Implement the request below.\n\n{message}",
+        'handoff': "You are the coder. Implement the consultant's plan.\n\n"
+                   "Request:\n{message}\n\nPlan:\n{previous}",
+    },
+}
+
+HANDOFF = 'handoff'    # each agent gets the previous agent's answer
+PARALLEL = 'parallel'  # every agent gets the message, all at once
+
+class Pipeline:
+    """One message run through a list of agent roles"""
+
+    def __init__(self, agents, process_id, message, roles, mode, session, client):
+        self.agents = agents
+        self.id = process_id
+        self.message = message
+        self.roles = roles
+        self.mode = mode
+        self.session = session
+        self.client = client
+        self.stages = {}  # role -> Flight
+        self.remaining = len(roles) if mode == PARALLEL else 1
+        self.cancelled = False
+        self.failed = False
+        self.events = SessionChannel(agents.events, session, pipeline=process_id)
+        self._lock = threading.Lock()
+
+    def stage_id(self, role):
+        return f"{self.id}:{role}"
+
+    def start(self, started=None):
+        """Submit the first agent (every agent in parallel mode)"""
+        try:
+            for index in range(len(self.roles) if self.mode == PARALLEL else 1):
+                # Only the first submission counts against the client's rate limit
+                with self._lock:
+                    self._run(index, started=started, limit=index == 0)
+        except Exception:
+            self.cancel()
+            raise
+
+    def _run(self, index, previous=None, started=None, limit=False):
+        role = self.roles[index]
+        spec = ROLES[role]
+        template = spec.get('handoff', spec['prompt']) if previous is not None else spec['prompt']
+        prompt = template.format(message=self.message, previous=previous)
+        stage_id = self.stage_id(role)
+        channel = SessionChannel(self.agents.events, self.session, agent=role, pipeline=self.id)
+        trace = tracing.tracer.start(started=started, processId=stage_id, agent=role,
+                                     pipeline=self.id)
+        flight, _ = self.agents.flights.join(None, stage_id, trace, channel,
+                                             lambda flight: self._finished(index, flight))
+        self.stages[role] = flight
+        trace.mark('queued')
+        try:
+            self.agents.pool.submit(prompt, flight, client=self.client, job_id=flight,
+                                    cost=1 + len(prompt) // 4096, limit=limit)
+        except Exception:
+            self.agents.flights.leave(stage_id)
+            trace.end(status='rejected')
+            raise
+
+    def _finished(self, index, flight):
+        # Called from a worker thread when one agent's run is over
+        role = self.roles[index]
+        failed = flight.cancelled or flight.error is not None or flight.returncode != 0
+        if self.mode == HANDOFF and not failed and index + 1 < len(self.roles):
+            following = self.roles[index + 1]
+            with self._lock:
+                # Checked and started together: an interrupt either stops the
+                # handoff or finds the next stage in self.stages
+                if not self.cancelled:
+                    self.events.put({'type': 'status', 'message': 'handoff',
+                                     'from': role, 'to': following})
+                    try:
+                        self._run(index + 1, previous=flight.output)
+                        return
+                    except Exception as e:
+                        self.events.put({'type': 'error', 'agent': following,
+                                         'message': f"handoff to {following} failed: {e}"})
+                failed = True
+        with self._lock:
+            self.failed = self.failed or failed or self.cancelled
+            self.remaining -= 1
+            if self.remaining:
+                return
+        self.agents.forget(self)
+        status = 'cancelled' if self.cancelled else 'failed' if self.failed else 'ok'
+        self.events.put({'type': 'status', 'message': 'pipeline done', 'status': status})
+
+    def cancel(self):
+        """Stop every running or queued agent; no further handoffs"""
+        with self._lock:
+            self.cancelled = True
+            stages = list(self.stages.items())
+        # Outside the lock: stopping a queued stage calls _finished at once
+        for role, flight in stages:
+            if self.agents.flights.leave(self.stage_id(role)) is flight \
+                    and not flight.subscribers:
+                self.agents.stop(flight)
+
+class Agents:
+    """Starts pipelines on the worker pool and finds them by processId"""
+
+    def __init__(self, pool, flights, events, stop):
+        self.pool = pool
+        self.flights = flights
+        self.events = events
+        self.stop = stop  # stop(flight): cancel a queued or running flight
+        self.pipelines = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def check(roles, mode):
+        """Raise ValueError unless roles and mode make a pipeline"""
+        if (not isinstance(roles, list) or not roles
+                or not all(isinstance(role, str) and role in ROLES for role in roles)
+                or len(set(roles)) != len(roles)):
+            raise ValueError(f"agents must be distinct roles from {sorted(ROLES)}")
+        if mode not in (HANDOFF, PARALLEL):
+            raise ValueError(f"mode must be {HANDOFF!r} or {PARALLEL!r}")
+
+    def start(self, message, roles, mode, process_id, session, client, started=None):
+        """Start a pipeline; raises ValueError for bad roles or mode"""
+        self.check(roles, mode)
+        pipeline = Pipeline(self, process_id, message, roles, mode, session, client)
+        with self._lock:
+            self.pipelines[process_id] = pipeline
+        try:
+            pipeline.start(started)
+        except Exception:
+            self.forget(pipeline)
+            raise
+        return pipeline
+
+    def cancel(self, process_id):
+        """Interrupt a pipeline; False if there is none with this processId
+
+        It stays registered until its last stage has finished.
+        """
+        with self._lock:
+            pipeline = self.pipelines.get(process_id)
+        if pipeline is None:
+            return False
+        pipeline.cancel()
+        return True
+
+    def forget(self, pipeline):
+        with self._lock:
+            if self.pipelines.get(pipeline.id) is pipeline:
+                del self.pipelines[pipeline.id]
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Asyncio server core for DataSenderApp
+Serves every route on one event loop so a long-lived /events stream
+never blocks /chat, /interrupt or static requests. Connections are
+HTTP/1.1 keep-alive, so a phone sending message after message reuses one
+TCP connection; request bodies may be sent with Content-Length or chunked.
+No external dependencies - uses only Python standard library
+"""
+
+import asyncio
+import inspect
+import json
+import os
+import sys
+import time
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import metrics
+import tracing
+from static_files import StaticCache
+
+CORS_HEADERS = [
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type'),
+]
+
+# Clients that do not name a session all share this one
+DEFAULT_SESSION = 'default'
+
+# Roughly when the process started (servers import this module first)
+STARTED = time.monotonic()
+
+EVENT_CLIENTS = metrics.gauge('datasender_event_clients', 'Connected event stream clients',
+                              ('transport',))
+# An idle keep-alive connection is closed after this many seconds
+KEEPALIVE_TIMEOUT = 15
+
+# Largest request body accepted
+MAX_BODY = 16 * 1024 * 1024
+
+STREAMED_BYTES = metrics.counter('datasender_streamed_bytes_total',
+                                 'Bytes of events written to clients', ('transport',))
+
+REASONS = {
+    101: 'Switching Protocols',
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    409: 'Conflict',
+    413: 'Content Too Large',
+    429: 'Too Many Requests',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+class BodyTooLarge(Exception):
+    """A request body over MAX_BODY"""
+
+class BadRequest(ValueError):
+    """Something the client has to fix; answered 400 rather than 500"""
+
+class Request:
+    """A parsed HTTP request"""
+
+    def __init__(self, method, target, version, headers, reader, writer):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = unquote(parts.path)
+        self.query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        self.version = version
+        self.headers = headers
+        self.reader = reader
+        self.writer = writer
+        self.body = b''
+        self.body_stream = None  # a BodyStream instead of body, for stream=True routes
+        self.received = time.monotonic()
+
+    def json(self):
+        """The body as a JSON object ({} if empty); raises BadRequest otherwise"""
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body)
+        except ValueError as e:
+            raise BadRequest(f"invalid JSON: {e}")
+        if not isinstance(data, dict):
+            raise BadRequest("the body must be a JSON object")
+        return data
+
+    def keep_alive(self):
+        """The client wants the connection kept open after this request"""
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return 'keep-alive' in connection
+        return 'close' not in connection and (self.body_stream is None or self.body_stream.done)
+
+class Response:
+    """A complete (non-streaming) HTTP response"""
+
+    def __init__(self, body=b'', status=200, content_type='application/json', headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or []
+
+class FileResponse(Response):
+    """A file sent straight from disk (os.sendfile where available)"""
+
+    def __init__(self, path, size, status=200, content_type='application/octet-stream',
+                 headers=None):
+        super().__init__(b'', status, content_type, headers)
+        self.path = path
+        self.size = size
+
+def json_response(data, status=200):
+    return Response(json.dumps(data).encode(), status)
+
+def start_response(writer, status, headers):
+    """Write a status line and headers (used by streaming handlers)"""
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+    lines += [f"{name}: {value}" for name, value in headers]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+def send_response(writer, response, keep_alive=False, body=True):
+    """Write a complete response; body=False for HEAD (headers still give the length)"""
+    headers = [('Content-Type', response.content_type)]
+    if response.status != 304:
+        length = response.size if isinstance(response, FileResponse) else len(response.body)
+        headers.append(('Content-Length', str(length)))
+    if keep_alive:
+        headers += [('Connection', 'keep-alive'), ('Keep-Alive', f'timeout={KEEPALIVE_TIMEOUT}')]
+    else:
+        headers.append(('Connection', 'close'))
+    headers += CORS_HEADERS[:1] + response.headers
+    start_response(writer, response.status, headers)
+    if body:
+        writer.write(response.body)
+
+class AsyncChatServer:
+    """Single-threaded asyncio HTTP server with the ChatHandler routes"""
+
+    def __init__(self, port, events, host='', heartbeat=30, greeting=None, root=None,
+                 ready=None, reuse_port=False):
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port  # several processes share the port (prefork)
+        self.events = events  # EventBus fed by the Claude threads
+        self.heartbeat = heartbeat
+        self.greeting = greeting
+        self.root = os.path.realpath(root or os.getcwd())
+        self.ready = ready  # ready() -> True once the CLI can take messages
+        self.routes = {}
+        self.streaming = set()  # routes that read their own body
+        self.static = StaticCache()
+        self.private = []  # realpaths of data files and directories never served
+        self.loop = None
+        self.route('GET', '/events', self.handle_events)
+        self.route('GET', '/metrics', self.handle_metrics)
+        self.route('GET', '/health', self.handle_health)
+        self.route('GET', '/ready', self.handle_ready)
+        self.route('GET', '/admin/profile', self.handle_profile)
+        metrics.gauge('datasender_from_claude_depth',
+                      'Events buffered for clients on the from_claude bus',
+                      function=events.depth)
+
+    def protect(self, *paths):
+        """Never serve these files (with their -wal/-shm companions) or directories"""
+        self.private.extend(os.path.realpath(path) for path in paths)
+
+    def is_private(self, path):
+        return any(path == private or path.startswith((private + os.sep, private + '-'))
+                   for private in self.private)
+
+    def route(self, method, path, handler, stream=False):
+        """Register a handler; it may be sync or async and return a dict or Response
+
+        With stream=True the body is not read up front: the handler reads it
+        from request.body_stream, with no MAX_BODY limit.
+        """
+        self.routes[(method, path)] = handler
+        if stream:
+            self.streaming.add((method, path))
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await self.read_request(reader, writer)
+                if request is None:
+                    break
+                try:
+                    response = await self.dispatch(request)
+                except BadRequest as e:
+                    response = json_response({'status': 'error', 'message': str(e)}, 400)
+                except Exception as e:
+                    print(f"Error handling {request.method} {request.path}: {e}", flush=True)
+                    response = json_response({'status': 'error', 'message': str(e)}, 500)
+                if response is None:
+                    # A streaming handler had the connection to itself
+                    break
+                keep_alive = request.keep_alive()
+                head_only = request.method == 'HEAD'
+                send_response(writer, response, keep_alive, not head_only)
+                self.log(request, response.status)
+                if isinstance(response, FileResponse) and not head_only:
+                    await writer.drain()
+                    with open(response.path, 'rb') as f:
+                        await self.loop.sendfile(writer.transport, f, 0, response.size)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader, writer):
+        """The next request on a connection; None once it is closed, idle or broken"""
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+            request_line, *header_lines = head.decode('latin-1').split('\r\n')
+            method, target, version = request_line.split(' ', 2)
+            headers = {}
+            for line in header_lines:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+            request = Request(method, target, version, headers, reader, writer)
+            request.server = self
+            chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+            length = 0 if chunked else int(headers.get('content-length') or 0)
+            body = BodyStream(reader, length, chunked)
+            if (method, request.path) in self.streaming:
+                request.body_stream = body
+            elif length > MAX_BODY:
+                raise BodyTooLarge
+            if not body.done and headers.get('expect', '').lower() == '100-continue':
+                writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            if request.body_stream is None and not body.done:
+                request.body = await body.read_all(MAX_BODY)
+            return request
+        except BodyTooLarge:
+            send_response(writer, json_response(
+                {'status': 'error', 'message': f'body over {MAX_BODY} bytes'}, 413))
+            return None
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ValueError):
+            return None
+
+    async def dispatch(self, request):
+        if request.method == 'OPTIONS':
+            # Handle CORS preflight
+            return Response(status=200, content_type='text/plain', headers=CORS_HEADERS[1:])
+
+        if request.method in ('GET', 'HEAD') and request.path == '/':
+            request.path = '/realtime_chat.html'
+
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            if request.method in ('GET', 'HEAD'):
+                return await self.serve_static(request)
+            return json_response({'status': 'error', 'message': 'not found'}, 404)
+
+        result = handler(request)
+        if inspect.isawaitable(result):
+            result = await result
+        if isinstance(result, dict):
+            return json_response(result)
+        return result
+
+    async def serve_static(self, request):
+        relative = request.path.lstrip('/')
+        if '..' in relative.replace('\\', '/').split('/'):
+            return Response(b'File not found', 404, 'text/plain')
+        path = os.path.realpath(os.path.join(self.root, relative))
+        # A prefix test would let /root-other/ through; compare whole components
+        if os.path.commonpath([self.root, path]) != self.root or self.is_private(path):
+            return Response(b'File not found', 404, 'text/plain')
+        entry = self.static.get(path)
+        if entry is None:
+            entry = await self.loop.run_in_executor(None, self.static.load, path)
+        if entry is None:
+            return Response(b'File not found', 404, 'text/plain')
+
+        encoding = entry.negotiate(request.headers.get('accept-encoding', ''))
+        etag = entry.etag(encoding)
+        # Revalidated on every load, which costs a 304 once the page is cached
+        headers = [('ETag', etag), ('Cache-Control', 'no-cache'), ('Vary', 'Accept-Encoding')]
+        if encoding != 'identity':
+            headers.append(('Content-Encoding', encoding))
+        matches = [tag.strip() for tag in request.headers.get('if-none-match', '').split(',')]
+        if etag in matches or '*' in matches:
+            return Response(b'', 304, entry.content_type, headers)
+        if not entry.cached:
+            return FileResponse(path, entry.size, 200, entry.content_type, headers)
+        return Response(entry.variants[encoding], 200, entry.content_type, headers)
+
+    def handle_health(self, request):
+        """The server process is up (the CLI may still be starting)"""
+        return {'status': 'ok', 'uptime': round(time.monotonic() - STARTED, 3)}
+
+    def handle_ready(self, request):
+        """200 once the CLI is responsive, 503 while it is starting"""
+        if self.ready is None or self.ready():
+            return {'status': 'ready'}
+        return json_response({'status': 'starting'}, 503)
+
+    def handle_metrics(self, request):
+        return Response(metrics.REGISTRY.render(), 200, 'text/plain; version=0.0.4')
+
+    async def handle_profile(self, request):
+        """Sample every thread for ?seconds=N; returns collapsed stacks"""
+        try:
+            seconds = min(float(request.query.get('seconds', 10)), 120)
+            interval = max(float(request.query.get('interval', 5)), 1) / 1000
+        except ValueError:
+            return json_response({'status': 'error', 'message': 'bad seconds or interval'}, 400)
+        try:
+            stacks = await self.loop.run_in_executor(
+                None, tracing.sample_stacks, seconds, interval)
+        except tracing.ProfilerBusy as e:
+            return json_response({'status': 'busy', 'message': str(e)}, 409)
+        return Response(stacks, 200, 'text/plain')
+
+    async def handle_events(self, request):
+        """Server-Sent Events for real-time updates"""
+        writer = request.writer
+        start_response(writer, 200, [
+            ('Content-Type', 'text/event-stream'),
+            ('Cache-Control', 'no-cache'),
+            ('Connection', 'close'),
+            ('Access-Control-Allow-Origin', '*'),
+        ])
+        self.log(request, 200)
+        print("Client connected to /events", flush=True)
+
+        # Browsers send Last-Event-ID on reconnect; our page passes it in the query
+        last_id = request.headers.get('last-event-id') or request.query.get('lastEventId')
+        try:
+            last_id = int(last_id) if last_id else None
+        except ValueError:
+            last_id = None
+        sub = self.events.subscribe(last_id, session=request.query.get('session', DEFAULT_SESSION),
+                                    agent=request.query.get('agent'))
+
+        # The client never sends anything after the request, so EOF means it left
+        closed = asyncio.ensure_future(request.reader.read(1))
+        waiter = None
+        EVENT_CLIENTS.inc(transport='sse')
+        try:
+            if self.greeting:
+                writer.write(f"data: {json.dumps(self.greeting)}\n\n".encode())
+                await writer.drain()
+
+            while True:
+                if waiter is None:
+                    waiter = asyncio.ensure_future(sub.wait())
+                done, _ = await asyncio.wait(
+                    [waiter, closed], timeout=self.heartbeat,
+                    return_when=asyncio.FIRST_COMPLETED)
+                if closed in done:
+                    break
+                if waiter in done:
+                    waiter = None
+                    if sub.dropped:
+                        print("Dropping slow /events client", flush=True)
+                        break
+                    batch = sub.drain()
+                    chunk = b''.join(format_event(event_id, data) for event_id, data in batch)
+                    STREAMED_BYTES.inc(len(chunk), transport='sse')
+                    writer.write(chunk)
+                    for _, data in batch:
+                        tracing.tracer.delivered(data, 'sse')
+                else:
+                    # Send heartbeat
+                    writer.write(b"data: {\"type\": \"heartbeat\"}\n\n")
+                await writer.drain()
+        except ConnectionError as e:
+            print(f"SSE error: {e}", flush=True)
+        finally:
+            EVENT_CLIENTS.dec(transport='sse')
+            self.events.unsubscribe(sub)
+            if waiter is not None:
+                waiter.cancel()
+            closed.cancel()
+        return None
+
+    def log(self, request, status):
+        peer = request.writer.get_extra_info('peername') or ('-',)
+        sys.stderr.write(f"{peer[0]} - - \"{request.method} {request.path}\" {status}\n")
+        sys.stderr.flush()
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(
+            self.handle_connection, self.host or None, self.port, backlog=1024,
+            reuse_port=self.reuse_port or None)
+        elapsed = (time.monotonic() - STARTED) * 1000
+        print(f"Listening on port {self.port} after {elapsed:.0f} ms", flush=True)
+        async with server:
+            await server.serve_forever()
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+def format_event(event_id, data):
+    return f"id: {event_id}\ndata: {json.dumps(data)}\n\n".encode()
+
+class BodyStream:
+    """A request body read as it arrives, sent with Content-Length or chunked"""
+
+    def __init__(self, reader, length=0, chunked=False):
+        self.reader = reader
+        self.chunked = chunked
+        self.length = None if chunked else length  # None: not known up front
+        self.remaining = length  # of the body, or of the current chunk
+        self.done = not chunked and not length
+
+    async def read(self, size=65536):
+        """Up to size bytes of the body; b'' at its end"""
+        if self.done:
+            return b''
+        if self.chunked and not self.remaining:
+            self.remaining = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            if not self.remaining:
+                # Last chunk; skip any trailers
+                while await self.reader.readuntil(b'\r\n') != b'\r\n':
+                    pass
+                self.done = True
+                return b''
+        data = await self.reader.read(min(size, self.remaining))
+        if not data:
+            raise asyncio.IncompleteReadError(b'', self.remaining)
+        self.remaining -= len(data)
+        if not self.remaining:
+            if self.chunked:
+                await self.reader.readexactly(2)
+            else:
+                self.done = True
+        return data
+
+    async def read_all(self, limit):
+        body = bytearray()
+        while True:
+            data = await self.read()
+            if not data:
+                return bytes(body)
+            body += data
+            if len(body) > limit:
+                raise BodyTooLarge
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Load test and latency benchmark for the DataSenderApp servers
+Starts a server variant against stub_claude.py, drives concurrent /chat
+POSTs while every client listens on its own /events stream (plus optional
+passive SSE readers), and reports time-to-first-byte, end-to-end latency
+percentiles, throughput and the server's CPU time and RSS. Results are
+written as JSON so runs can be compared between versions.
+
+    python3 benchmark.py simple_server.py simple_server_v2.py simple_server_v3.py \\
+        --clients 4 --messages 10 --tokens 200 --rate 400 --output bench.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+END = '<<END-OF-REPLY>>'
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def percentile(values, pct):
+    """Nearest-rank percentile, None for no samples"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50_ms': _ms(percentile(values, 50)),
+        'p90_ms': _ms(percentile(values, 90)),
+        'p99_ms': _ms(percentile(values, 99)),
+        'max_ms': _ms(max(values) if values else None),
+    }
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+class ProcessSampler(threading.Thread):
+    """Samples a process's CPU time and RSS every interval seconds"""
+
+    def __init__(self, pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []  # (cpu_seconds, rss_kb)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            sample = read_usage(self.pid)
+            if sample is None:
+                break
+            self.samples.append(sample)
+
+    def report(self):
+        if not self.samples:
+            return {'cpu_seconds': None, 'rss_max_kb': None}
+        return {
+            'cpu_seconds': round(self.samples[-1][0] - self.samples[0][0], 3),
+            'rss_max_kb': max(rss for _, rss in self.samples),
+            'rss_end_kb': self.samples[-1][1],
+        }
+
+def read_usage(pid):
+    """(cpu_seconds, rss_kb) from /proc, falling back to ps (macOS)"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = os.sysconf('SC_CLK_TCK')
+        cpu = (int(fields[11]) + int(fields[12])) / ticks
+        with open(f'/proc/{pid}/status') as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+        return cpu, rss
+    except FileNotFoundError:
+        pass
+    except (OSError, StopIteration, IndexError, ValueError):
+        return None
+    try:
+        out = subprocess.run(['ps', '-o', 'rss=,time=', '-p', str(pid)],
+                             capture_output=True, text=True).stdout.split()
+        rss, cputime = int(out[0]), out[1]
+    except (OSError, IndexError, ValueError):
+        return None
+    days, _, clock = cputime.rpartition('-')
+    seconds = 0.0
+    for part in clock.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds + int(days or 0) * 86400, rss
+
+def open_events(port, session):
+    """Open /events and stream parsed data events into a queue"""
+    events = queue.Queue()
+    conn = http.client.HTTPConnection('localhost', port, timeout=None)
+    conn.request('GET', f'/events?session={session}')
+    response = conn.getresponse()
+
+    def read():
+        try:
+            for line in response:
+                if line.startswith(b'data: '):
+                    events.put((time.perf_counter(), json.loads(line[6:])))
+        except (OSError, ValueError):
+            pass
+        events.put((time.perf_counter(), None))
+
+    threading.Thread(target=read, daemon=True).start()
+    return conn, events
+
+def post_chat(port, body):
+    conn = http.client.HTTPConnection('localhost', port, timeout=30)
+    try:
+        conn.request('POST', '/chat', json.dumps(body), {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+class Client(threading.Thread):
+    """Sends messages one after another and times each reply"""
+
+    def __init__(self, index, args, start_gate):
+        super().__init__(daemon=True)
+        self.index = index
+        self.args = args
+        self.start_gate = start_gate
+        self.session = f'bench-{index}'
+        self.ttfb = []
+        self.e2e = []
+        self.bytes = 0
+        self.errors = 0
+
+    def mine(self, data, process_id):
+        if 'processId' in data:
+            return data['processId'] == process_id
+        return data.get('session') in (None, self.session)
+
+    def exchange(self, n):
+        """One message and its reply; returns (ttfb, e2e, bytes) or None"""
+        process_id = f'{self.session}-{n}-{time.time()}'
+        # Without context: the stub echoes its prompt, and earlier replies quoted
+        # in it would carry the end marker before the reply has even started
+        body = {'message': f'benchmark {process_id}', 'processId': process_id,
+                'session': self.session, 'cache': False, 'context': False}
+        started = time.perf_counter()
+        if post_chat(self.args.port, body) != 200:
+            return None
+        first = None
+        size = 0
+        deadline = started + self.args.timeout
+        while True:
+            try:
+                at, data = self.events.get(timeout=max(0.01, deadline - time.perf_counter()))
+            except queue.Empty:
+                return None
+            if data is None:
+                return None
+            if data.get('type') == 'error' and self.mine(data, process_id):
+                return None
+            if data.get('type') != 'response' or not self.mine(data, process_id):
+                continue
+            first = first or at
+            size += len(data.get('message', ''))
+            if END in data.get('message', ''):
+                return first - started, at - started, size
+
+    def run(self):
+        self.conn, self.events = open_events(self.args.port, self.session)
+        # Warm-up exchanges (e.g. a session's first CLI start) are not measured
+        for n in range(self.args.warmup):
+            self.exchange(f'warmup{n}')
+        self.start_gate.wait()
+        for n in range(self.args.messages):
+            try:
+                result = self.exchange(n)
+            except OSError:
+                result = None
+            if result is None:
+                self.errors += 1
+                continue
+            self.ttfb.append(result[0])
+            self.e2e.append(result[1])
+            self.bytes += result[2]
+        self.conn.close()
+
+def wait_until_ready(port, proc, timeout=30):
+    """Wait for /ready: the server binds at once, its CLI may take longer"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'server exited with code {proc.returncode}')
+        try:
+            conn = http.client.HTTPConnection('localhost', port, timeout=0.5)
+            conn.request('GET', '/ready')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+            conn.close()
+        except OSError:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f'server on port {port} did not become ready')
+
+def run_variant(server, args):
+    env = dict(os.environ,
+               PORT=str(args.port),
+               CLAUDE_BIN=os.path.join(HERE, 'stub_claude.py'),
+               STUB_TOKENS=str(args.tokens),
+               STUB_TOKEN_SIZE=str(args.token_size),
+               STUB_RATE=str(args.rate),
+               STUB_STARTUP=str(args.startup),
+               STUB_END=END,
+               WORKERS=str(args.workers),
+               # Benchmark messages never go to the archive
+               SUPABASE_URL='', SUPABASE_KEY='',
+               # Every client shares 127.0.0.1; a per-client limit would measure itself
+               RATE_LIMIT='0')
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, server)], cwd=HERE, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(args.port, proc)
+        readers = [open_events(args.port, f'bench-reader-{i}')[0] for i in range(args.readers)]
+
+        gate = threading.Barrier(args.clients + 1)
+        clients = [Client(i, args, gate) for i in range(args.clients)]
+        for client in clients:
+            client.start()
+        gate.wait()
+
+        sampler = ProcessSampler(proc.pid)
+        sampler.samples.append(read_usage(proc.pid))
+        sampler.start()
+        started = time.perf_counter()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - started
+        sampler.stopped.set()
+        sampler.join()
+        sample = read_usage(proc.pid)
+        if sample:
+            sampler.samples.append(sample)
+
+        for conn in readers:
+            conn.close()
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    ttfb = [t for c in clients for t in c.ttfb]
+    e2e = [t for c in clients for t in c.e2e]
+    completed = len(e2e)
+    usage = sampler.report()
+    if usage['cpu_seconds'] is not None and elapsed:
+        usage['cpu_percent'] = round(100 * usage['cpu_seconds'] / elapsed, 1)
+    return {
+        'server': server,
+        'elapsed_s': round(elapsed, 3),
+        'completed': completed,
+        'errors': sum(c.errors for c in clients),
+        'throughput_msgs_per_s': round(completed / elapsed, 2) if elapsed else None,
+        'throughput_bytes_per_s': round(sum(c.bytes for c in clients) / elapsed) if elapsed else None,
+        'ttfb': summarize(ttfb),
+        'e2e': summarize(e2e),
+        'server_usage': usage,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('servers', nargs='*', default=['simple_server_v3.py'])
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--clients', type=int, default=4, help='concurrent chatting clients')
+    parser.add_argument('--readers', type=int, default=0, help='extra passive /events readers')
+    parser.add_argument('--messages', type=int, default=10, help='messages per client')
+    parser.add_argument('--warmup', type=int, default=1, help='unmeasured messages per client')
+    parser.add_argument('--tokens', type=int, default=100, help='stub tokens per reply')
+    parser.add_argument('--token-size', type=int, default=4, help='stub bytes per token')
+    parser.add_argument('--rate', type=float, default=0, help='stub tokens/second (0 = unthrottled)')
+    parser.add_argument('--startup', type=float, default=0, help='stub start-up delay in seconds')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='prefork worker processes (v3; usage counts the parent only)')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for one reply')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    for server in args.servers:
+        print(f"Benchmarking {server} ...", flush=True)
+        result = run_variant(server, args)
+        results.append(result)
+        print(f"  completed {result['completed']} (errors {result['errors']}) "
+              f"in {result['elapsed_s']}s, {result['throughput_msgs_per_s']} msg/s")
+        print(f"  ttfb p50/p90/p99: {result['ttfb']['p50_ms']}/{result['ttfb']['p90_ms']}/"
+              f"{result['ttfb']['p99_ms']} ms")
+        print(f"  e2e  p50/p90/p99: {result['e2e']['p50_ms']}/{result['e2e']['p90_ms']}/"
+              f"{result['e2e']['p99_ms']} ms")
+        print(f"  server: {result['server_usage']}")
+
+    if args.output:
+        config = {k: v for k, v in vars(args).items() if k not in ('servers', 'output')}
+        with open(args.output, 'w') as f:
+            json.dump({'created': time.time(), 'config': config, 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Adaptive output coalescing for streamed responses
+Sits between the CLI output reader and the event bus. The first text of
+a reply is sent at once (low time-to-first-token); after that, text is
+batched into fewer, larger events. The batching window starts short and
+doubles with every flush up to max_delay, so short replies stay snappy
+while long replies become a few large frames instead of thousands of
+tiny ones. After a quiet period the next text is again sent at once.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+# Tuned for phones on slow links: few, larger frames once a reply is flowing
+MIN_DELAY = 0.05
+MAX_DELAY = 0.25
+MAX_SIZE = 4096
+
+class _FlushScheduler:
+    """One timer thread for every coalescer's pending flush"""
+
+    def __init__(self):
+        self._heap = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, when, coalescer):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="coalescer-flush")
+                self._thread.daemon = True
+                self._thread.start()
+            heapq.heappush(self._heap, (when, next(self._order), coalescer))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # Sleeps with no timeout when nothing is scheduled
+                while not self._heap:
+                    self._cond.wait()
+                when, _, coalescer = self._heap[0]
+                delay = when - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+            coalescer._deadline_reached(when)
+
+_scheduler = _FlushScheduler()
+
+class Coalescer:
+    """Buffers text written from any thread and calls emit(text) in batches"""
+
+    def __init__(self, emit, min_delay=MIN_DELAY, max_delay=MAX_DELAY, max_size=MAX_SIZE):
+        self.emit = emit
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_size = max_size
+        self.buffer = []
+        self.size = 0
+        self.window = min_delay
+        self.deadline = None
+        self.last_emit = None
+        self.flushes = 0
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        if not text:
+            return
+        with self._lock:
+            now = time.monotonic()
+            quiet = self.last_emit is None or now - self.last_emit > self.max_delay
+            if quiet and not self.buffer:
+                # First bytes of a reply: send immediately, start with a short window
+                self.window = self.min_delay
+                self._emit(text, now)
+                return
+            self.buffer.append(text)
+            self.size += len(text)
+            if self.size >= self.max_size:
+                self._emit_buffer(now)
+            elif self.deadline is None:
+                self.deadline = (self.last_emit or now) + self.window
+                _scheduler.schedule(self.deadline, self)
+
+    def flush(self):
+        """Send anything buffered now (e.g. when the reply has ended)"""
+        with self._lock:
+            if self.buffer:
+                self._emit_buffer(time.monotonic())
+
+    def reset(self):
+        """A new reply is starting: flush the old one, send the next text at once"""
+        with self._lock:
+            if self.buffer:
+                self._emit_buffer(time.monotonic())
+            self.last_emit = None
+            self.window = self.min_delay
+
+    def _deadline_reached(self, when):
+        with self._lock:
+            if self.deadline == when and self.buffer:
+                self._emit_buffer(time.monotonic())
+
+    def _emit_buffer(self, now):
+        text = ''.join(self.buffer)
+        self.buffer = []
+        self.size = 0
+        self.window = min(self.window * 2, self.max_delay)
+        self._emit(text, now)
+
+    def _emit(self, text, now):
+        self.deadline = None
+        self.last_emit = now
+        self.flushes += 1
+        self.emit(text)
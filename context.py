@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Conversation context for print-mode runs
+Every /chat message in v3 is a fresh `claude --print` run, so on its own
+it knows nothing of the messages before it. Resending the whole
+transcript would make every turn slower and dearer than the last.
+Instead each session keeps a window of its most recent turns verbatim
+plus a running summary of everything older, and a prompt is the summary,
+the window and the new message. Turns that slide out of the window are
+folded into the summary in the background, a few at a time, by a
+summarize(prompt, done) callback: the previous summary and the new turns
+go in, a new summary comes out, so no request ever waits for it. Turns,
+the summary and the whole prompt have size limits, so a long session
+costs about as much per message as a short one.
+No external dependencies - uses only Python standard library
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import metrics
+
+# Turns kept verbatim; 0 turns context off
+WINDOW = int(os.environ.get('CONTEXT_TURNS', 6))
+
+# Fold turns into the summary once this many have left the window
+SUMMARIZE_EVERY = int(os.environ.get('CONTEXT_SUMMARIZE_EVERY', 4))
+
+# Size limits, in characters
+TURN_CHARS = int(os.environ.get('CONTEXT_TURN_CHARS', 2000))
+SUMMARY_CHARS = int(os.environ.get('CONTEXT_SUMMARY_CHARS', 3000))
+PROMPT_CHARS = int(os.environ.get('CONTEXT_PROMPT_CHARS', 16000))
+
+# Turns waiting for a summary when summaries keep failing; older ones are dropped
+MAX_UNSUMMARIZED = 4 * SUMMARIZE_EVERY
+
+SUMMARY_PROMPT = (
+    "Update the running summary of a conversation between a user and an assistant. "
+    "Keep facts, decisions, names, file and code identifiers and open questions; "
+    "drop pleasantries. Reply with the updated summary only, in at most {words} words."
+    "\n\nCurrent summary:\n{summary}\n\nNew messages:\n{turns}")
+
+SUMMARIES = metrics.counter('datasender_context_summaries_total',
+                            'Background summary refreshes', ('status',))
+
+class Discard:
+    """Event sink for runs nobody watches, such as summaries"""
+
+    def put(self, data):
+        pass
+
+class Conversation:
+    """Rolling state of one session"""
+
+    def __init__(self):
+        self.recent = []  # (turn id, message, reply), the window
+        self.unsummarized = []  # turns out of the window, not yet in the summary
+        self.summary = ''
+        self.covered = {}  # ids of recent turns in the summary, oldest first (prefork)
+        self.summarizing = False
+        self.used = time.monotonic()
+
+class Conversations:
+    """Per-session context: builds prompts, records turns, refreshes summaries"""
+
+    def __init__(self, summarize=None, window=WINDOW, summarize_every=SUMMARIZE_EVERY,
+                 turn_chars=TURN_CHARS, summary_chars=SUMMARY_CHARS,
+                 prompt_chars=PROMPT_CHARS, max_sessions=1000, max_idle=24 * 3600):
+        # summarize(prompt, done): run prompt in the background, then done(text or None);
+        # None: summaries come from elsewhere through apply() (prefork)
+        self.summarize = summarize
+        self.window = window
+        self.summarize_every = summarize_every
+        self.turn_chars = turn_chars
+        self.summary_chars = summary_chars
+        self.prompt_chars = prompt_chars
+        self.max_sessions = max_sessions
+        self.max_idle = max_idle
+        self.forward = None  # forward(change): other processes keep the same state (prefork)
+        self.sessions = OrderedDict()  # session -> Conversation, least recently used first
+        self._lock = threading.Lock()
+        metrics.gauge('datasender_context_sessions', 'Sessions with conversation context',
+                      function=lambda: len(self.sessions))
+
+    def _get(self, session, create=False):
+        now = time.monotonic()
+        with self._lock:
+            conversation = self.sessions.get(session)
+            if conversation is not None and now - conversation.used > self.max_idle:
+                del self.sessions[session]
+                conversation = None
+            if conversation is None and create:
+                conversation = self.sessions[session] = Conversation()
+                while len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+            if conversation is not None:
+                conversation.used = now
+                self.sessions.move_to_end(session)
+            return conversation
+
+    def prompt(self, session, message):
+        """The prompt for a new message: summary, recent turns, then the message"""
+        conversation = self._get(session) if self.window else None
+        if conversation is None:
+            return message
+        with self._lock:
+            summary = conversation.summary
+            # Turns a pending summary will cover still count as recent until it lands
+            turns = conversation.unsummarized + conversation.recent
+        budget = self.prompt_chars - len(summary) - len(message)
+        quoted = []
+        for _, said, replied in reversed(turns):
+            text = f"User: {said}\nAssistant: {replied}"
+            if len(text) > budget:
+                break
+            budget -= len(text) + 2
+            quoted.append(text)
+        if not summary and not quoted:
+            return message
+        sections = []
+        if summary:
+            sections.append(f"Summary of the conversation so far:\n{summary}")
+        if quoted:
+            sections.append("Recent messages:\n" + '\n\n'.join(reversed(quoted)))
+        sections.append(f"Current message:\n{message}")
+        return '\n\n'.join(sections)
+
+    def record(self, session, message, reply):
+        """A finished turn; may start a background summary"""
+        if not self.window or not reply.strip():
+            return
+        message = clip(message, self.turn_chars)
+        reply = clip(reply.strip(), self.turn_chars)
+        # Named here, where it happened: every process knows the turn by this id
+        turn = uuid.uuid4().hex[:16]
+        self._append(session, turn, message, reply)
+        if self.forward is not None:
+            self.forward({'session': session, 'turn': turn, 'message': message,
+                          'reply': reply})
+
+    def _append(self, session, turn, message, reply):
+        conversation = self._get(session, create=True)
+        with self._lock:
+            if turn in conversation.covered:
+                # Forwarded after a summary that already holds it
+                return
+            conversation.recent.append((turn, message, reply))
+            while len(conversation.recent) > self.window:
+                conversation.unsummarized.append(conversation.recent.pop(0))
+            del conversation.unsummarized[:-MAX_UNSUMMARIZED]
+            due = (self.summarize is not None and not conversation.summarizing
+                   and len(conversation.unsummarized) >= self.summarize_every)
+            if due:
+                conversation.summarizing = True
+                turns = list(conversation.unsummarized)
+                summary = conversation.summary
+        if due:
+            self._refresh(session, conversation, summary, turns)
+
+    def _refresh(self, session, conversation, summary, turns):
+        prompt = SUMMARY_PROMPT.format(
+            words=self.summary_chars // 6, summary=summary or '(none yet)',
+            turns='\n\n'.join(f"User: {said}\nAssistant: {replied}" for _, said, replied in turns))
+        # By id, not position: other processes may hold the turns in another order
+        covered = [turn for turn, _, _ in turns]
+
+        def done(text):
+            if text and text.strip():
+                SUMMARIES.inc(status='ok')
+                self._summarized(conversation, clip(text.strip(), self.summary_chars), covered)
+                if self.forward is not None:
+                    self.forward({'session': session, 'summary': conversation.summary,
+                                  'covered': covered})
+            else:
+                # Left for the next turn to retry
+                SUMMARIES.inc(status='failed')
+            with self._lock:
+                conversation.summarizing = False
+
+        try:
+            self.summarize(prompt, done)
+        except Exception as e:
+            print(f"Context summary for {session} not started: {e}", flush=True)
+            SUMMARIES.inc(status='failed')
+            with self._lock:
+                conversation.summarizing = False
+
+    def _summarized(self, conversation, summary, covered):
+        with self._lock:
+            conversation.summary = summary
+            conversation.covered.update(dict.fromkeys(covered))
+            while len(conversation.covered) > 4 * MAX_UNSUMMARIZED:
+                del conversation.covered[next(iter(conversation.covered))]
+            covered = conversation.covered
+            # A process that saw the turns in another order may still hold some in its window
+            conversation.recent = [turn for turn in conversation.recent
+                                   if turn[0] not in covered]
+            conversation.unsummarized = [turn for turn in conversation.unsummarized
+                                         if turn[0] not in covered]
+
+    def apply(self, change):
+        """A turn or summary forwarded by another process"""
+        session = change.get('session')
+        if 'summary' in change:
+            conversation = self._get(session, create=True)
+            self._summarized(conversation, change['summary'], change['covered'])
+        else:
+            self._append(session, change['turn'], change['message'], change['reply'])
+
+    def clear(self, session):
+        with self._lock:
+            self.sessions.pop(session, None)
+
+    def stats(self):
+        with self._lock:
+            conversations = list(self.sessions.values())
+        return {'sessions': len(conversations),
+                'summarizing': sum(c.summarizing for c in conversations),
+                'unsummarized': sum(len(c.unsummarized) for c in conversations)}
+
+def clip(text, limit):
+    """At most limit characters, keeping the start and the end"""
+    if len(text) <= limit:
+        return text
+    half = (limit - 5) // 2
+    return f"{text[:half]} ... {text[-half:]}"
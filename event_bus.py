@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Broadcast event bus for DataSenderApp
+Every subscriber (SSE client) gets its own bounded ring buffer, events
+carry increasing ids, and a short shared history lets a reconnecting
+client replay what it missed via Last-Event-ID.
+"""
+
+import asyncio
+import threading
+from collections import deque
+
+import metrics
+
+ERRORS = metrics.counter('datasender_errors_total', 'Error events sent to clients')
+
+# What to do when a subscriber's buffer is full
+SKIP = 'skip'  # discard the oldest buffered events, the client skips ahead
+DROP = 'drop'  # disconnect the subscriber; it can reconnect and replay
+
+class Subscriber:
+    """One consumer of the bus, read from an asyncio event loop"""
+
+    def __init__(self, bus, loop, maxlen, session=None, agent=None):
+        self.bus = bus
+        self.loop = loop
+        self.maxlen = maxlen
+        self.session = session
+        self.agent = agent  # only this agent's events (for a split view)
+        self.buffer = deque()
+        self.dropped = False
+        self.skipped = 0
+        self._wake = asyncio.Event()
+        self._waiting = False
+
+    def _push(self, event):
+        # Called with the bus lock held, from any thread
+        if self.dropped or not self.wants(event[1]):
+            return
+        if len(self.buffer) >= self.maxlen:
+            if self.bus.policy == DROP:
+                self.dropped = True
+                self.buffer.clear()
+            else:
+                self.buffer.popleft()
+                self.skipped += 1
+                self.buffer.append(event)
+        else:
+            self.buffer.append(event)
+        if self._waiting:
+            self._waiting = False
+            self.loop.call_soon_threadsafe(self._wake.set)
+
+    def wants(self, data):
+        """Events tagged with another client's session are not ours"""
+        if not isinstance(data, dict):
+            return self.agent is None
+        tag = data.get('session')
+        if tag is not None and tag != self.session:
+            return False
+        return self.agent is None or data.get('agent') == self.agent
+
+    async def wait(self):
+        """Wait until there is something to drain (or the subscriber was dropped)"""
+        with self.bus._lock:
+            if self.buffer or self.dropped:
+                return
+            self._wake.clear()
+            self._waiting = True
+        await self._wake.wait()
+
+    def drain(self):
+        """Take every buffered (id, data) pair"""
+        with self.bus._lock:
+            events = list(self.buffer)
+            self.buffer.clear()
+        return events
+
+class EventBus:
+    """Thread-safe publish/subscribe bus replacing the from_claude queue"""
+
+    def __init__(self, history=1000, buffer_size=256, policy=SKIP):
+        self.policy = policy
+        self.buffer_size = buffer_size
+        self.history = deque(maxlen=history)
+        self.subscribers = set()
+        # relay(data) sends events elsewhere to be numbered (the prefork hub);
+        # they come back through deliver()
+        self.relay = None
+        self.taps = []  # tap(data) sees every event added here, e.g. to record it
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def publish(self, data):
+        """Broadcast an event to every subscriber; returns its id (None if relayed)"""
+        if isinstance(data, dict) and data.get('type') == 'error':
+            ERRORS.inc()
+        if self.relay is not None:
+            self.relay(data)
+            return None
+        with self._lock:
+            event_id = self._next_id
+            self._add((event_id, data))
+        return event_id
+
+    def deliver(self, event_id, data):
+        """Broadcast an event that was numbered elsewhere"""
+        with self._lock:
+            self._add((event_id, data))
+
+    def _add(self, event):
+        # Called with the lock held
+        self._next_id = max(self._next_id, event[0] + 1)
+        self.history.append(event)
+        for sub in self.subscribers:
+            sub._push(event)
+        for tap in self.taps:
+            tap(event[1])
+
+    # Same call the Claude threads already use on the old queue.Queue
+    put = publish
+
+    def subscribe(self, last_event_id=None, loop=None, session=None, agent=None):
+        """Add a subscriber, replaying history newer than last_event_id"""
+        sub = Subscriber(self, loop or asyncio.get_running_loop(), self.buffer_size,
+                         session, agent)
+        with self._lock:
+            if last_event_id is not None:
+                missed = [e for e in self.history
+                          if e[0] > last_event_id and sub.wants(e[1])]
+                sub.buffer.extend(missed[-self.buffer_size:])
+            self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self.subscribers.discard(sub)
+
+    def depth(self):
+        """Events waiting in subscriber buffers"""
+        with self._lock:
+            return sum(len(sub.buffer) for sub in self.subscribers)
+
+    @property
+    def last_id(self):
+        return self._next_id - 1
+
+class SessionChannel:
+    """Publishes to a bus with every event tagged for one session (plus any extra tags)"""
+
+    def __init__(self, bus, session, **tags):
+        self.bus = bus
+        self.session = session
+        self.tags = tags
+
+    def publish(self, data):
+        return self.bus.publish(dict(data, session=self.session, **self.tags))
+
+    put = publish
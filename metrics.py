@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Prometheus-style metrics for DataSenderApp
+A small registry of counters, gauges and histograms rendered in the
+Prometheus text format at /metrics. Recording is a dict update under a
+per-metric lock, so it is cheap enough for the streaming path; gauges
+that describe state elsewhere (queue depths, process RSS) are callbacks
+evaluated only when /metrics is scraped.
+No external dependencies - uses only Python standard library
+"""
+
+import bisect
+import os
+import subprocess
+import threading
+
+# Latency buckets in seconds, from a fast spawn to a long answer
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=(), function=None):
+        super().__init__(name, help, labels)
+        # function() returns a number, or {label values tuple: number}
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        try:
+            value = self.function()
+        except Exception as e:
+            print(f"Metric {self.name} failed: {e}", flush=True)
+            return []
+        if isinstance(value, dict):
+            return [(self.name, tuple(str(v) for v in key), v) for key, v in value.items()]
+        return [(self.name, (), value)]
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            items = [(key, list(counts), total, count)
+                     for key, (counts, total, count) in self.values.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                out.append((f"{self.name}_bucket", key + (le,), cumulative))
+            out.append((f"{self.name}_sum", key, total))
+            out.append((f"{self.name}_count", key, count))
+        return out
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, key, value in self.samples():
+            names = self.labels + ('le',) if name.endswith('_bucket') else self.labels
+            lines.append(f"{name}{_format_labels(names, key)} {_format_value(value)}")
+        return lines
+
+class Registry:
+    """Metrics by name; registering a name twice returns the first metric"""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=(), function=None):
+        gauge = self._register(Gauge, name, help, labels)
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help, labels, buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+# CLI latencies, shared by print mode (worker pool) and interactive sessions
+SPAWN_SECONDS = histogram('claude_spawn_seconds', 'Time to start a Claude CLI process',
+                          ('mode',))
+FIRST_OUTPUT_SECONDS = histogram('claude_first_output_seconds',
+                                 'Time from sending a message to its first output', ('mode',))
+RESPONSE_SECONDS = histogram('claude_response_seconds',
+                             'Time from sending a message to its last output', ('mode',))
+
+def process_rss(pid):
+    """Resident set size of a process in bytes, None if it is gone"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+        return None
+    except FileNotFoundError:
+        if os.path.isdir('/proc'):
+            return None
+    except OSError:
+        return None
+    try:
+        out = subprocess.run(['ps', '-o', 'rss=', '-p', str(pid)],
+                             capture_output=True, text=True).stdout.strip()
+        return int(out) * 1024 if out else None
+    except (OSError, ValueError):
+        return None
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
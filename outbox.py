@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Server-side archive of chat messages in Supabase
+The browser used to POST every message to Supabase itself: one TLS
+handshake per message on a phone radio, and a failure was lost. Now the
+server archives them. add() only queues a row. A writer thread stores
+rows in a SQLite outbox, so they survive a restart or a Supabase outage.
+A sender thread takes them out in batches - when a batch is full or the
+oldest row has waited a flush interval - and sends each batch as one
+bulk insert over a kept-alive connection. Rows are deleted only once
+Supabase has accepted them; failures are retried with backoff. Each row
+carries an idempotency key, so a batch resent after a lost reply cannot
+be stored twice (see OUTBOX_KEY_COLUMN).
+
+Point SUPABASE_URL at stub_supabase.py, with any SUPABASE_KEY, to try it offline.
+No external dependencies - uses only Python standard library
+"""
+
+import atexit
+import http.client
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import metrics
+from supervisor import Backoff
+
+# Archiving is off unless both SUPABASE_URL and SUPABASE_KEY are set
+SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
+SUPABASE_KEY = os.environ.get('SUPABASE_KEY', '')
+SUPABASE_TABLE = os.environ.get('SUPABASE_TABLE', 'texts')
+
+OUTBOX_PATH = os.environ.get('OUTBOX_PATH', 'outbox.db')
+BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH', 100))
+FLUSH_INTERVAL = float(os.environ.get('OUTBOX_INTERVAL', 2))
+
+# A unique text column of the table that holds the idempotency key, e.g.
+#   alter table texts add column idempotency_key text unique;
+# Inserts then skip keys already stored. Without it the key is only kept
+# in metadata, and a batch resent after a lost reply may be stored twice.
+KEY_COLUMN = os.environ.get('OUTBOX_KEY_COLUMN', '')
+
+# Statuses that mean the rows themselves are bad; any other failure keeps the
+# rows and is retried with backoff, including 401/403/404 (a wrong key or table)
+REJECTED = (400, 409, 422)
+
+SENT = metrics.counter('datasender_archive_sent_total', 'Rows archived to Supabase')
+FAILED = metrics.counter('datasender_archive_failed_total', 'Rows Supabase rejected')
+RETRIES = metrics.counter('datasender_archive_retries_total', 'Archive batches retried',
+                          ('reason',))
+
+class Outbox:
+    """Durable queue of rows for Supabase, sent in the background"""
+
+    def __init__(self, path=OUTBOX_PATH, url=SUPABASE_URL, key=SUPABASE_KEY,
+                 table=SUPABASE_TABLE, key_column=KEY_COLUMN, batch_size=BATCH_SIZE,
+                 interval=FLUSH_INTERVAL, max_pending=10000, timeout=10):
+        self.path = path
+        self.url = url.rstrip('/')
+        self.key = key
+        self.table = table
+        self.key_column = key_column
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self.stored = 0  # rows in the outbox, as last counted by the sender
+        self.backoff = Backoff(base=1, maximum=300)
+        self.connection = None
+        self.connection_requests = 0
+        self.sending = False
+        self._wake = threading.Event()
+        self._lock = threading.Lock()  # one writer of the SQLite connection at a time
+        self.db = None
+        metrics.gauge('datasender_archive_pending', 'Rows waiting to be archived',
+                      function=lambda: self.stored + self.pending.qsize())
+
+    @property
+    def enabled(self):
+        return bool(self.url and self.key)
+
+    def start(self, send=True):
+        """Start the writer, and the sender unless another process sends (prefork)"""
+        if self.url and not self.key:
+            print("Outbox: SUPABASE_URL is set but SUPABASE_KEY is not; archiving is off",
+                  flush=True)
+        if not self.enabled:
+            return self
+        self.db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        # Prefork workers share the file; one of them sends
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, row TEXT NOT NULL,
+            created REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0)''')
+        self.db.commit()
+        writer = threading.Thread(target=self._write, name="outbox-writer")
+        writer.daemon = True
+        writer.start()
+        atexit.register(self._store_pending)
+        if send:
+            self.sending = True
+            sender = threading.Thread(target=self._send_forever, name="outbox-sender")
+            sender.daemon = True
+            sender.start()
+        return self
+
+    def add(self, content, **metadata):
+        """Queue one row for the archive; never blocks"""
+        if not self.enabled:
+            return None
+        key = uuid.uuid4().hex
+        metadata.setdefault('timestamp', datetime.now(timezone.utc).isoformat())
+        metadata['idempotency_key'] = key
+        row = {'content': content, 'metadata': metadata}
+        if self.key_column:
+            row[self.key_column] = key
+        try:
+            self.pending.put_nowait((key, json.dumps(row), time.time()))
+        except queue.Full:
+            # The disk is stuck; dropping beats blocking a request
+            self.dropped += 1
+        return key
+
+    def _write(self):
+        while True:
+            batch = [self.pending.get()]
+            while len(batch) < 1000:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            self._store(batch)
+
+    def _store(self, batch):
+        try:
+            with self._lock:
+                self.db.executemany('INSERT OR IGNORE INTO outbox (key, row, created) '
+                                    'VALUES (?, ?, ?)', batch)
+                self.db.commit()
+        except sqlite3.Error as e:
+            self.dropped += len(batch)
+            print(f"Outbox: could not store {len(batch)} rows: {e}", flush=True)
+            return
+        if self.sending:
+            self.stored += len(batch)
+            if self.stored >= self.batch_size:
+                self._wake.set()
+
+    def _store_pending(self):
+        """At exit: move rows still in memory to disk"""
+        batch = []
+        while True:
+            try:
+                batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._store(batch)
+
+    def _send_forever(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                delay = self.flush()
+            except Exception as e:
+                delay = self.backoff.next()
+                print(f"Outbox: flush failed: {e}", flush=True)
+            if delay:
+                time.sleep(delay)
+
+    def flush(self):
+        """Send every stored row; seconds to wait before the next try, or 0"""
+        while True:
+            batch = self._due()
+            if not batch:
+                return 0
+            delay = self._deliver(batch)
+            if delay:
+                return delay
+            self.backoff.reset()
+
+    def _due(self):
+        with self._lock:
+            rows = self.db.execute('SELECT id, row FROM outbox WHERE failed = 0 '
+                                   'ORDER BY id LIMIT ?', (self.batch_size,)).fetchall()
+            self.stored = self.db.execute('SELECT count(*) FROM outbox WHERE failed = 0'
+                                          ).fetchone()[0]
+        return rows
+
+    def _deliver(self, batch):
+        """Send rows as one insert; a delay if Supabase should be retried later"""
+        ids = [row_id for row_id, _ in batch]
+        try:
+            status, retry_after = self._post('[' + ','.join(row for _, row in batch) + ']')
+        except (OSError, http.client.HTTPException) as e:
+            RETRIES.inc(reason='connection')
+            delay = self.backoff.next()
+            print(f"Outbox: {self.url} unreachable ({e}); retrying in {delay:g} s", flush=True)
+            self._attempted(ids)
+            return delay
+        if 200 <= status < 300:
+            with self._lock:
+                self.db.executemany('DELETE FROM outbox WHERE id = ?', [(i,) for i in ids])
+                self.db.commit()
+            SENT.inc(len(ids))
+            return 0
+        if status not in REJECTED:
+            RETRIES.inc(reason=str(status))
+            delay = max(self.backoff.next(), retry_after)
+            hint = " (check SUPABASE_KEY and SUPABASE_TABLE)" if status in (401, 403, 404) else ""
+            print(f"Outbox: Supabase answered {status}{hint}; retrying in {delay:g} s",
+                  flush=True)
+            self._attempted(ids)
+            return delay
+        if len(batch) > 1:
+            # One bad row fails the whole insert; find it by sending them singly
+            for row in batch:
+                delay = self._deliver([row])
+                if delay:
+                    return delay
+            return 0
+        # Kept in the outbox for inspection, but not sent again
+        print(f"Outbox: Supabase rejected row {ids[0]} ({status})", flush=True)
+        FAILED.inc()
+        with self._lock:
+            self.db.execute('UPDATE outbox SET failed = 1, attempts = attempts + 1 '
+                            'WHERE id = ?', (ids[0],))
+            self.db.commit()
+        return 0
+
+    def _attempted(self, ids):
+        with self._lock:
+            self.db.executemany('UPDATE outbox SET attempts = attempts + 1 WHERE id = ?',
+                                [(i,) for i in ids])
+            self.db.commit()
+
+    def _post(self, body):
+        """POST to the table over the kept-alive connection: (status, retry-after)"""
+        parts = urlsplit(self.url)
+        path = f"{parts.path}/rest/v1/{self.table}"
+        prefer = 'return=minimal'
+        if self.key_column:
+            path += f"?on_conflict={self.key_column}"
+            prefer += ',resolution=ignore-duplicates'
+        headers = {'apikey': self.key, 'Authorization': f'Bearer {self.key}',
+                   'Content-Type': 'application/json', 'Prefer': prefer}
+        while True:
+            reused = self.connection is not None and self.connection_requests > 0
+            if self.connection is None:
+                cls = (http.client.HTTPSConnection if parts.scheme == 'https'
+                       else http.client.HTTPConnection)
+                self.connection = cls(parts.netloc, timeout=self.timeout)
+                self.connection_requests = 0
+            try:
+                self.connection.request('POST', path, body.encode(), headers)
+                response = self.connection.getresponse()
+                response.read()
+            except ConnectionError:
+                self._disconnect()
+                if reused:
+                    # The server closed an idle connection; the keys make a resend safe
+                    continue
+                raise
+            except Exception:
+                self._disconnect()
+                raise
+            self.connection_requests += 1
+            if response.will_close:
+                self._disconnect()
+            try:
+                retry_after = float(response.getheader('Retry-After') or 0)
+            except ValueError:
+                retry_after = 0
+            return response.status, retry_after
+
+    def _disconnect(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def stats(self):
+        return {'pending': self.pending.qsize(), 'stored': self.stored,
+                'dropped': self.dropped, 'sending': self.sending}
+
+def device(request):
+    """The device label the chat page used to send"""
+    return 'iPhone' if 'iPhone' in request.headers.get('user-agent', '') else 'Desktop'
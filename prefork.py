@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Prefork mode for DataSenderApp
+With WORKERS=N the server script runs as a small parent process plus N
+copies of itself. Every worker binds the same port with SO_REUSEPORT, so
+the kernel spreads connections over them and each has its own GIL for
+JSON encoding, coalescing and SSE writes. Events are fanned out through a
+hub in the parent over a Unix socket: a worker sends each event it
+publishes to the hub, which numbers it and sends it to every worker, so
+an /events stream on any worker sees every session's output with the
+same event ids (and Last-Event-ID replay works across workers). Control
+messages, such as an interrupt for a run owned by another worker, travel
+the same way. The parent restarts workers that exit.
+No external dependencies - uses only Python standard library
+"""
+
+import _thread
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from supervisor import Backoff
+
+WORKERS = int(os.environ.get('WORKERS', 1))
+
+# Set in the environment of worker processes
+HUB = os.environ.get('PREFORK_HUB')
+WORKER = os.environ.get('PREFORK_WORKER')
+
+# Longest frame on the hub socket
+MAX_FRAME = 16 * 1024 * 1024
+
+# A worker that falls this far behind is disconnected (and so restarted)
+MAX_BACKLOG = 64 * 1024 * 1024
+
+# Frames are one line each: b'E' + json (event) or b'C' + json (control);
+# the hub sends events back as b'E<id> ' + json
+EVENT, CONTROL = b'E', b'C'
+
+class Hub:
+    """Runs in the parent: numbers events and sends them to every worker"""
+
+    def __init__(self, path):
+        self.path = path
+        self.workers = set()
+        self.next_id = 1
+
+    async def handle(self, reader, writer):
+        self.workers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line[:1] == EVENT:
+                    frame = b'E%d %s' % (self.next_id, line[1:])
+                    self.next_id += 1
+                    targets = list(self.workers)
+                else:
+                    # Control messages go to the other workers only
+                    frame = line
+                    targets = [w for w in self.workers if w is not writer]
+                for target in targets:
+                    if target.transport.get_write_buffer_size() > MAX_BACKLOG:
+                        print("Prefork hub: dropping a worker that stopped reading", flush=True)
+                        self.workers.discard(target)
+                        target.close()
+                        continue
+                    target.write(frame)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self.workers.discard(writer)
+            writer.close()
+
+class Parent:
+    """Starts the hub and keeps WORKERS copies of the server script running"""
+
+    def __init__(self, workers, argv=None):
+        self.count = workers
+        self.argv = argv or [sys.executable] + sys.argv
+        self.path = os.path.join(tempfile.gettempdir(), f'datasender-{os.getpid()}.sock')
+        self.procs = [None] * workers
+        self.backoff = [Backoff(maximum=30) for _ in range(workers)]
+        self.respawn_at = [0] * workers
+
+    def _spawn(self, index):
+        env = dict(os.environ, PREFORK_HUB=self.path, PREFORK_WORKER=str(index))
+        self.procs[index] = subprocess.Popen(self.argv, env=env)
+        self.procs[index].started = time.monotonic()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stopping = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stopping.set)
+        hub = Hub(self.path)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(hub.handle, self.path, limit=MAX_FRAME)
+        for index in range(self.count):
+            self._spawn(index)
+        print(f"Prefork: {self.count} workers, event hub on {self.path}", flush=True)
+        async with server:
+            while not stopping.is_set():
+                try:
+                    await asyncio.wait_for(stopping.wait(), 1)
+                except asyncio.TimeoutError:
+                    self._check()
+            # Workers go first, so their hub connections close cleanly
+            await loop.run_in_executor(None, self.stop)
+
+    def _check(self):
+        now = time.monotonic()
+        for index, proc in enumerate(self.procs):
+            if proc is None or proc.poll() is None:
+                if proc is not None and now - proc.started > 60:
+                    self.backoff[index].reset()
+                continue
+            if not self.respawn_at[index]:
+                delay = self.backoff[index].next()
+                self.respawn_at[index] = now + delay
+                print(f"Worker {index} exited ({proc.returncode}); restarting in {delay:g} s",
+                      flush=True)
+            elif now >= self.respawn_at[index]:
+                self.respawn_at[index] = 0
+                self._spawn(index)
+
+    def stop(self):
+        for proc in self.procs:
+            if proc is not None and proc.poll() is None:
+                # SIGINT lets a worker shut its CLI processes down cleanly
+                proc.send_signal(signal.SIGINT)
+        for proc in self.procs:
+            if proc is not None:
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self.run())
+        finally:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+class Link:
+    """Runs in a worker: routes an EventBus through the hub"""
+
+    def __init__(self, bus, path=HUB, on_control=None):
+        self.bus = bus
+        self.on_control = on_control  # on_control(data), called on the link thread
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self._lock = threading.Lock()
+        bus.relay = self.publish
+        thread = threading.Thread(target=self._read, name="prefork-link")
+        thread.daemon = True
+        thread.start()
+
+    def _send(self, kind, data):
+        frame = kind + json.dumps(data).encode() + b'\n'
+        with self._lock:
+            self.sock.sendall(frame)
+
+    def publish(self, data):
+        self._send(EVENT, data)
+
+    def control(self, data):
+        """Send a control message to every other worker"""
+        self._send(CONTROL, data)
+
+    def _read(self):
+        for line in self.sock.makefile('rb'):
+            try:
+                if line[:1] == EVENT:
+                    event_id, payload = line[1:].split(b' ', 1)
+                    self.bus.deliver(int(event_id), json.loads(payload))
+                elif self.on_control is not None:
+                    self.on_control(json.loads(line[1:]))
+            except Exception as e:
+                print(f"Prefork link: bad frame: {e}", flush=True)
+        # The parent is gone; shut down the way Ctrl-C would
+        print("Prefork hub closed, stopping worker", flush=True)
+        _thread.interrupt_main()
+
+def is_worker():
+    return HUB is not None
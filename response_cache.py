@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Response cache for `claude --print` results
+Content-addressed by the normalized prompt plus the CLI flags. Lookups
+go to an in-memory LRU (bounded in bytes) first, then to a SQLite file
+whose entries expire after a TTL; disk hits are promoted to memory.
+Disk writes go through one writer thread, so a commit's fsync never
+holds up a lookup; callers on the event loop use get_memory() inline and
+run get() - which may read the disk - in an executor.
+"""
+
+import hashlib
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+def normalize(prompt):
+    """Ignore leading/trailing and repeated whitespace"""
+    return re.sub(r'\s+', ' ', prompt).strip()
+
+def cache_key(prompt, flags=()):
+    material = '\0'.join([normalize(prompt)] + list(flags))
+    return hashlib.sha256(material.encode()).hexdigest()
+
+class ResponseCache:
+    """Two-tier (memory LRU + SQLite) cache of complete responses"""
+
+    def __init__(self, path='response_cache.db', max_bytes=8 * 1024 * 1024, ttl=24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.memory = OrderedDict()  # key -> (stored_at, response)
+        self.memory_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.puts = 0
+        self._lock = threading.Lock()  # the memory tier and counters
+        self._db_lock = threading.Lock()  # the reading connection
+        self.writes = queue.Queue()  # (key, response, stored_at), or None to clear
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            # Prefork workers share the file; WAL lets them read while one writes
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, response TEXT NOT NULL, stored_at REAL NOT NULL)''')
+            self.db.commit()
+            writer = threading.Thread(target=self._write, name="response-cache-writer")
+            writer.daemon = True
+            writer.start()
+
+    def get_memory(self, key):
+        """The answer if it is in the memory tier; never touches the disk"""
+        now = time.time()
+        with self._lock:
+            entry = self.memory.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._forget(key)
+            return None
+
+    def get(self, key):
+        """Memory, then disk; blocking, so run it off the event loop"""
+        response = self.get_memory(key)
+        if response is not None:
+            return response
+        if self.db is not None:
+            with self._db_lock:
+                row = self.db.execute(
+                    'SELECT response, stored_at FROM responses WHERE key = ? AND stored_at > ?',
+                    (key, time.time() - self.ttl)).fetchone()
+            if row is not None:
+                with self._lock:
+                    self._remember(key, row[1], row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                return row[0]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self.puts += 1
+            self._remember(key, now, response)
+        if self.db is not None:
+            self.writes.put((key, response, now))
+
+    def _write(self):
+        # Its own connection: commits never wait on, or hold up, a lookup
+        db = sqlite3.connect(self.path, timeout=30)
+        written = 0
+        while True:
+            batch = [self.writes.get()]
+            while True:
+                try:
+                    batch.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for item in batch:
+                    if item is None:
+                        db.execute('DELETE FROM responses')
+                    else:
+                        db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?)', item)
+                        written += 1
+                # Expire old rows now and then rather than on every write
+                if written >= 100:
+                    written = 0
+                    db.execute('DELETE FROM responses WHERE stored_at <= ?',
+                               (time.time() - self.ttl,))
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"Response cache: write failed: {e}", flush=True)
+
+    def _remember(self, key, stored_at, response):
+        size = len(response.encode())
+        if size > self.max_bytes // 4:
+            return  # one huge answer should not flush the whole memory tier
+        self._forget(key)
+        self.memory[key] = (stored_at, response)
+        self.memory_bytes += size
+        while self.memory_bytes > self.max_bytes:
+            self._forget(next(iter(self.memory)))
+
+    def _forget(self, key):
+        entry = self.memory.pop(key, None)
+        if entry is not None:
+            self.memory_bytes -= len(entry[1].encode())
+
+    def clear(self):
+        with self._lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+        if self.db is not None:
+            self.writes.put(None)
+
+    def stats(self):
+        disk_entries = 0
+        if self.db is not None:
+            with self._db_lock:
+                disk_entries = self.db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0,
+                'memory_entries': len(self.memory),
+                'memory_bytes': self.memory_bytes,
+                'disk_entries': disk_entries,
+            }
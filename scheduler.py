@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Fair scheduling of queued CLI work across clients
+Replaces the worker pool's single FIFO admission queue. Work waits in
+priority lanes (interactive before batch); within a lane every client has
+its own queue, served by deficit round robin, so one chatty client cannot
+starve the rest. Each client also has a token bucket that limits how fast
+it may submit. Queued work can be cancelled by id before any CLI process
+is spent on it.
+No external dependencies - uses only Python standard library
+"""
+
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Priority lanes, served strictly in this order
+INTERACTIVE, BATCH = 0, 1
+
+class RateLimited(Exception):
+    """The client's token bucket is empty"""
+
+    def __init__(self, client, retry_after):
+        super().__init__(f"client {client} is over its rate limit")
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """rate tokens per second, holding at most burst"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now=None):
+        """Take a token; returns 0, or the seconds until one is available"""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+class Scheduler:
+    """Queue-like: put_nowait(item, client=..., lane=...) and a blocking get()"""
+
+    def __init__(self, maxsize=32, lanes=2, quantum=1, rate=2.0, burst=20):
+        self.maxsize = maxsize
+        self.quantum = quantum
+        self.rate = rate  # per client; 0 disables rate limiting
+        self.burst = burst
+        # Per lane: client -> deque of [job_id, item, cost], in round robin order
+        self.lanes = [OrderedDict() for _ in range(lanes)]
+        self.deficits = [{} for _ in range(lanes)]
+        self.buckets = {}
+        self.where = {}  # job_id -> (lane, client)
+        self.size = 0
+        self.closed = False
+        self._ids = itertools.count()
+        self._cond = threading.Condition()
+
+    def put_nowait(self, item, client=None, lane=INTERACTIVE, job_id=None, cost=1,
+                   limit=True):
+        """Queue item; raises queue.Full or RateLimited instead of waiting
+
+        limit=False skips the rate limit, for follow-up work of a request
+        that was already admitted.
+        """
+        with self._cond:
+            if self.size >= self.maxsize:
+                raise queue.Full
+            if self.rate and limit:
+                self._limit(client)
+            if job_id is None:
+                job_id = ('job', next(self._ids))
+            self.lanes[lane].setdefault(client, deque()).append([job_id, item, cost])
+            self.where[job_id] = (lane, client)
+            self.size += 1
+            self._cond.notify()
+
+    def _limit(self, client):
+        now = time.monotonic()
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            if len(self.buckets) >= 1024:
+                # Forget clients that have been quiet long enough to refill
+                for idle in [c for c, b in self.buckets.items() if b.full(now)]:
+                    del self.buckets[idle]
+            bucket = self.buckets[client] = TokenBucket(self.rate, self.burst)
+        wait = bucket.take(now)
+        if wait:
+            raise RateLimited(client, wait)
+
+    def get(self):
+        """Next item by lane, then deficit round robin; None once closed"""
+        with self._cond:
+            while not self.size and not self.closed:
+                self._cond.wait()
+            if not self.size:
+                return None
+            lane = next(n for n, clients in enumerate(self.lanes) if clients)
+            return self._next(lane)
+
+    def _next(self, lane):
+        clients = self.lanes[lane]
+        deficits = self.deficits[lane]
+        while True:
+            client, jobs = next(iter(clients.items()))
+            job_id, item, cost = jobs[0]
+            if deficits.get(client, 0) >= cost:
+                # Still this client's turn: its credit covers the next job
+                jobs.popleft()
+                deficits[client] -= cost
+                if not jobs:
+                    del clients[client]
+                    deficits.pop(client, None)
+                del self.where[job_id]
+                self.size -= 1
+                return item
+            # Turn over: credit the client for its next turn and move on
+            deficits[client] = deficits.get(client, 0) + self.quantum
+            clients.move_to_end(client)
+
+    def cancel(self, job_id):
+        """Remove queued work; False if it is unknown or already running"""
+        with self._cond:
+            location = self.where.pop(job_id, None)
+            if location is None:
+                return False
+            lane, client = location
+            jobs = self.lanes[lane][client]
+            for job in jobs:
+                if job[0] == job_id:
+                    jobs.remove(job)
+                    break
+            if not jobs:
+                del self.lanes[lane][client]
+                self.deficits[lane].pop(client, None)
+            self.size -= 1
+            return True
+
+    def qsize(self):
+        return self.size
+
+    def close(self):
+        """Wake every get() with None once the queue is empty"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': self.size,
+                'lanes': [{str(client): len(jobs) for client, jobs in clients.items()}
+                          for clients in self.lanes],
+            }
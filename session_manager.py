@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Per-session Claude CLI processes for interactive mode
+Each client session gets its own long-lived `claude` process and input
+queue, so several people or devices can chat in parallel without their
+conversations interleaving. The number of live processes is capped; when
+a new session needs a slot the least recently used idle one is closed.
+A session outlives its process: when the supervisor restarts or recycles
+the CLI, queued messages wait in the inbox for the new one.
+"""
+
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+import supervisor
+import tracing
+
+# A CLI that prints nothing on start-up counts as ready after this many seconds
+READY_AFTER = float(os.environ.get('CLAUDE_READY_AFTER', 10))
+
+class SessionLimit(Exception):
+    """Every live session is busy, so none can be evicted"""
+
+class Session:
+    """One client session and its CLI process"""
+
+    def __init__(self, session_id, proc, events, ready_after=READY_AFTER):
+        self.id = session_id
+        self.proc = proc
+        self.events = events
+        self.inbox = queue.Queue()  # per-session replacement for to_claude
+        self.started = time.monotonic()
+        self.last_used = self.started
+        # Set on the CLI's first output; messages wait in the inbox until then
+        self.ready = threading.Event()
+        self.ready_after = ready_after
+        self.messages = 0  # sent to the current process
+        self.closed = False
+        self._restarted = threading.Event()
+        # Latency of the message currently being answered (there is no end marker,
+        # so a reply is taken to end with the last output before the next message)
+        self.sent_at = None
+        self.first_output_at = None
+        self.last_output_at = None
+        self.trace = None
+        writer = threading.Thread(target=self._write_input, name=f"session-{session_id}")
+        writer.daemon = True
+        writer.start()
+
+    def _write_input(self):
+        # Blocks without polling until a message (or None on close) arrives
+        while True:
+            item = self.inbox.get()
+            if item is None or not self._wait_ready():
+                break
+            message, trace = item
+            try:
+                print(f"Sending to Claude [{self.id}]: {message}", flush=True)
+                # Before the write, as output can arrive before flush() returns
+                self._reply_started(trace)
+                self.proc.stdin.write(message + '\n')
+                self.proc.stdin.flush()
+                self.events.put(tracing.tag({'type': 'status', 'message': 'thinking',
+                                             'session': self.id}, trace))
+            except (OSError, ValueError) as e:
+                self.events.put(tracing.tag({'type': 'error', 'message': str(e),
+                                             'session': self.id}, trace))
+                if trace is not None:
+                    trace.end(status='error')
+
+    def _wait_ready(self):
+        """Wait until the current process can take input; False once closed"""
+        while not self.closed:
+            if not self.alive():
+                # Crashed: hold the message until the supervisor restarts it
+                self._restarted.wait(0.5)
+                self._restarted.clear()
+            elif self.ready.is_set():
+                return True
+            else:
+                remaining = self.ready_after - (time.monotonic() - self.started)
+                if remaining <= 0:
+                    self._mark_ready(f"no output after {self.ready_after:g} s")
+                    return True
+                self.ready.wait(min(remaining, 0.5))
+        return False
+
+    def send(self, message, trace=None):
+        self.last_used = time.monotonic()
+        self.messages += 1
+        if trace is not None:
+            trace.mark('queued')
+        self.inbox.put((message, trace))
+
+    def _mark_ready(self, how):
+        if not self.ready.is_set():
+            self.ready.set()
+            elapsed = (time.monotonic() - self.started) * 1000
+            print(f"Claude CLI ready [{self.id}] after {elapsed:.0f} ms ({how})", flush=True)
+            self.events.put({'type': 'status', 'message': 'ready', 'session': self.id})
+
+    def touch(self):
+        self.last_used = time.monotonic()
+        if not self.ready.is_set():
+            self._mark_ready("first output")
+        if self.sent_at is not None:
+            self.last_output_at = self.last_used
+            if self.first_output_at is None:
+                self.first_output_at = self.last_used
+                metrics.FIRST_OUTPUT_SECONDS.observe(self.last_used - self.sent_at,
+                                                     mode='interactive')
+                if self.trace is not None:
+                    self.trace.mark('first_output', self.last_used)
+                    self.trace.since('sent', 'first_output', self.last_used)
+
+    def _reply_started(self, trace):
+        self._reply_ended()
+        self.sent_at = time.monotonic()
+        self.first_output_at = None
+        self.last_output_at = None
+        self.trace = trace
+        if trace is not None:
+            # Waiting behind earlier messages plus the handoff to the writer thread
+            trace.since('queued', 'queue', self.sent_at)
+            trace.mark('sent', self.sent_at)
+
+    def _reply_ended(self):
+        if self.sent_at is not None and self.last_output_at is not None:
+            metrics.RESPONSE_SECONDS.observe(self.last_output_at - self.sent_at,
+                                             mode='interactive')
+        if self.trace is not None:
+            end = self.last_output_at or time.monotonic()
+            self.trace.since('sent', 'cli', end)
+            self.trace.end(end)
+            self.trace = None
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def idle(self, quiet_for):
+        """No queued input and no input or output for quiet_for seconds"""
+        return self.inbox.empty() and time.monotonic() - self.last_used >= quiet_for
+
+    def restart(self, proc):
+        """Swap in a new CLI process; the conversation starts over"""
+        self._reply_ended()
+        old, self.proc = self.proc, proc
+        self.ready.clear()
+        self.started = time.monotonic()
+        self.messages = 0
+        self._restarted.set()
+        _stop(old)
+
+    def close(self):
+        self.closed = True
+        self._reply_ended()
+        self.inbox.put(None)
+        self._restarted.set()
+        self.ready.set()  # wakes a writer still waiting for start-up
+        _stop(self.proc)
+
+def _stop(proc):
+    if proc.poll() is None:
+        supervisor.terminate(proc)
+        # Reap in the background so the caller (often the event loop) never waits
+        reaper = threading.Thread(target=_reap, args=(proc,))
+        reaper.daemon = True
+        reaper.start()
+
+def _reap(proc):
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        supervisor.kill(proc)
+        proc.wait()
+
+class SessionManager:
+    """Maps client session ids to Sessions with LRU eviction"""
+
+    def __init__(self, spawn, events, max_sessions=4, idle_after=30, ready_after=READY_AFTER):
+        self.spawn = spawn  # spawn(session_id) -> Popen with its reader started
+        self.events = events
+        self.ready_after = ready_after
+        self.max_sessions = max_sessions
+        self.idle_after = idle_after
+        self.sessions = OrderedDict()
+        self.supervisor = None  # set by Supervisor.start()
+        self._lock = threading.Lock()
+        metrics.gauge('datasender_to_claude_depth', 'Messages waiting for a CLI process',
+                      function=lambda: sum(s.inbox.qsize() for s in list(self.sessions.values())))
+        metrics.gauge('datasender_active_processes', 'Live CLI processes',
+                      function=lambda: sum(s.alive() for s in list(self.sessions.values())))
+        metrics.gauge('claude_process_rss_bytes', 'Resident memory of each CLI process',
+                      ('pid', 'owner'), function=self.rss)
+
+    def get(self, session_id):
+        """Return the live session, starting (and evicting) as needed"""
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                self.sessions.move_to_end(session_id)
+                if not session.alive():
+                    if self.supervisor is not None:
+                        # Messages wait for the restart, which honours the backoff
+                        self.supervisor.wake()
+                    else:
+                        session.restart(self._spawn(session_id))
+                return session
+
+            while len(self.sessions) >= self.max_sessions:
+                self._evict()
+
+            session = Session(session_id, self._spawn(session_id), self.events, self.ready_after)
+            self.sessions[session_id] = session
+            return session
+
+    def _spawn(self, session_id):
+        started = time.monotonic()
+        proc = self.spawn(session_id)
+        metrics.SPAWN_SECONDS.observe(time.monotonic() - started, mode='interactive')
+        return proc
+
+    def restart(self, session):
+        """Give a session a new CLI process (crash restart or recycling)"""
+        proc = self._spawn(session.id)
+        with self._lock:
+            if self.sessions.get(session.id) is not session:
+                # Evicted meanwhile
+                _stop(proc)
+                return
+            session.restart(proc)
+
+    def live(self):
+        with self._lock:
+            return list(self.sessions.values())
+
+    def _evict(self):
+        # OrderedDict order is least recently used first
+        for session_id, session in self.sessions.items():
+            if (not session.alive() and session.inbox.empty()) or session.idle(self.idle_after):
+                del self.sessions[session_id]
+                print(f"Evicting idle session {session_id}", flush=True)
+                session.close()
+                self.events.put({'type': 'status', 'message': 'session closed',
+                                 'session': session_id})
+                return
+        raise SessionLimit(f"all {self.max_sessions} sessions are busy")
+
+    def send(self, session_id, message, trace=None):
+        self.get(session_id).send(message, trace)
+
+    def touch(self, session_id):
+        """Mark a session as used (e.g. when it produced output)"""
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.touch()
+            with self._lock:
+                if session_id in self.sessions:
+                    self.sessions.move_to_end(session_id)
+
+    def is_ready(self, session_id):
+        """The session's CLI is running and has shown it is responsive"""
+        session = self.sessions.get(session_id)
+        return session is not None and session.alive() and session.ready.is_set()
+
+    def trace(self, session_id):
+        """Trace of the message a session is currently answering, if any"""
+        session = self.sessions.get(session_id)
+        return session.trace if session is not None else None
+
+    def close_all(self):
+        with self._lock:
+            while self.sessions:
+                _, session = self.sessions.popitem()
+                session.close()
+
+    def rss(self):
+        """{(pid, session id): bytes} for every live session process"""
+        with self._lock:
+            procs = [(session.proc, session_id) for session_id, session in self.sessions.items()]
+        sizes = {}
+        for proc, session_id in procs:
+            size = metrics.process_rss(proc.pid)
+            if size is not None:
+                sizes[(proc.pid, session_id)] = size
+        return sizes
+
+    def stats(self):
+        with self._lock:
+            return {session_id: {'alive': session.alive(),
+                                 'pending': session.inbox.qsize(),
+                                 'messages': session.messages}
+                    for session_id, session in self.sessions.items()}
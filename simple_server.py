@@ -4,138 +4,116 @@ Simple backend server for DataSenderApp
 No external dependencies - uses only Python standard library
 """
 
-import http.server
-import socketserver
 import subprocess
-import json
+import os
 import threading
-import queue
-import time
-from urllib.parse import parse_qs
+
+from async_server import AsyncChatServer, DEFAULT_SESSION, json_response
+from event_bus import EventBus
+from websocket import serve_websocket
+from worker_pool import CLAUDE_BIN
+from session_manager import SessionManager, SessionLimit
+from transcripts import TranscriptStore
+from outbox import Outbox, device
+import supervisor
+import tracing
 
 # Message queues
-to_claude = queue.Queue()
-from_claude = queue.Queue()
+from_claude = EventBus()
+
+# Claude processes, one per client session (created in __main__)
+sessions = None
+
+# Durable per-session transcripts behind /history (created in __main__)
+history = None
+
+# Messages on their way to the Supabase archive (created in __main__)
+archive = None
 
-# Claude process
-claude_process = None
+def spawn_claude(session_id):
+    """Start a Claude CLI process for one session and stream its output"""
+    # Start Claude CLI
+    proc = supervisor.spawn(
+        [CLAUDE_BIN],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1
+    )
+    
+    print(f"Claude CLI started successfully for session {session_id}")
+    
+    # Monitor output in separate thread
+    def read_output():
+        for line in iter(proc.stdout.readline, ''):
+            sessions.touch(session_id)
+            from_claude.put(tracing.tag({'type': 'response', 'message': line.strip(),
+                                         'session': session_id}, sessions.trace(session_id)))
+    
+    output_thread = threading.Thread(target=read_output)
+    output_thread.daemon = True
+    output_thread.start()
+    
+    return proc
 
-def run_claude():
-    """Run Claude CLI and handle I/O"""
-    global claude_process
+def handle_chat(request):
+    data = request.json()
     
+    message = data.get('message', '')
+    if not isinstance(message, str) or not message.strip():
+        return json_response({'status': 'error', 'message': 'message must be a non-empty string'},
+                             400)
+    session_id = data.get('session') or DEFAULT_SESSION
+    print(f"Received [{session_id}]: {message}")
+    
+    # The trace id travels with the session into every event of this reply
+    trace = tracing.tracer.start(data.get('traceId') or request.headers.get('x-trace-id'),
+                                 started=request.received, session=session_id)
+    
+    # Queue message for this session's Claude
     try:
-        # Start Claude CLI
-        claude_process = subprocess.Popen(
-            ['claude'],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1
-        )
-        
-        print("Claude CLI started successfully")
-        
-        # Monitor output in separate thread
-        def read_output():
-            while claude_process and claude_process.poll() is None:
-                line = claude_process.stdout.readline()
-                if line:
-                    from_claude.put({'type': 'response', 'message': line.strip()})
-        
-        output_thread = threading.Thread(target=read_output)
-        output_thread.daemon = True
-        output_thread.start()
-        
-        # Process input
-        while claude_process and claude_process.poll() is None:
-            try:
-                message = to_claude.get(timeout=0.1)
-                claude_process.stdin.write(message + '\n')
-                claude_process.stdin.flush()
-                from_claude.put({'type': 'status', 'message': 'thinking'})
-            except queue.Empty:
-                pass
-                
+        sessions.send(session_id, message, trace)
+    except SessionLimit as e:
+        trace.end(status='busy')
+        return json_response({'status': 'busy', 'message': str(e)}, 503)
     except Exception as e:
+        trace.end(status='error')
         print(f"Error running Claude: {e}")
-        from_claude.put({'type': 'error', 'message': str(e)})
-
-class ChatHandler(http.server.SimpleHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/':
-            self.path = '/realtime_chat.html'
-        elif self.path == '/events':
-            # Server-Sent Events for real-time updates
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/event-stream')
-            self.send_header('Cache-Control', 'no-cache')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            
-            # Send updates
-            while True:
-                try:
-                    data = from_claude.get(timeout=1)
-                    event = f"data: {json.dumps(data)}\n\n"
-                    self.wfile.write(event.encode())
-                    self.wfile.flush()
-                except queue.Empty:
-                    # Send heartbeat
-                    self.wfile.write(b"data: {\"type\": \"heartbeat\"}\n\n")
-                    self.wfile.flush()
-                except:
-                    break
-            return
-        
-        return super().do_GET()
-    
-    def do_POST(self):
-        if self.path == '/chat':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data)
-            
-            message = data.get('message', '')
-            print(f"Received: {message}")
-            
-            # Queue message for Claude
-            to_claude.put(message)
-            
-            # Send response
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            response = {'status': 'queued'}
-            self.wfile.write(json.dumps(response).encode())
+        from_claude.put({'type': 'error', 'message': str(e), 'session': session_id})
+        return json_response({'status': 'error', 'message': str(e)}, 500)
     
-    def do_OPTIONS(self):
-        # Handle CORS preflight
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
+    history.record_user(session_id, message)
+    archive.add(f"[REALTIME_CHAT] {message}", source='realtime_chat', device=device(request))
+    trace.span('http', request.received)
+    return {'status': 'queued', 'session': session_id, 'traceId': trace.id}
 
 if __name__ == '__main__':
-    PORT = 8080
+    PORT = int(os.environ.get('PORT', 8080))
     
-    # Start Claude in background thread
-    claude_thread = threading.Thread(target=run_claude)
-    claude_thread.daemon = True
-    claude_thread.start()
-    
-    # Give Claude a moment to start
-    time.sleep(2)
+    # Start Claude for the default session; others start on first message
+    sessions = SessionManager(spawn_claude, from_claude, max_sessions=4)
+    history = TranscriptStore().start()
+    from_claude.taps.append(history.record_event)
+    archive = Outbox().start()
+    # Bind at once; messages wait in the session inbox until the CLI is ready
+    sessions.get(DEFAULT_SESSION)
+    # Restart crashed CLIs with backoff, recycle them as they grow
+    supervisor.Supervisor(sessions, from_claude).start()
     
     # Start web server
-    with socketserver.TCPServer(("", PORT), ChatHandler) as httpd:
-        print(f"\n🚀 DataSenderApp Backend Server")
-        print(f"📍 Local: http://localhost:{PORT}")
-        print(f"📱 Network: http://YOUR_IP:{PORT}")
-        print(f"\n✨ Claude CLI integration active")
-        print(f"🌐 Open http://localhost:{PORT} in your browser\n")
-        
-        httpd.serve_forever()
\ No newline at end of file
+    server = AsyncChatServer(PORT, from_claude, heartbeat=1,
+                             ready=lambda: sessions.is_ready(DEFAULT_SESSION))
+    server.route('GET', '/ws', serve_websocket)
+    server.route('POST', '/chat', handle_chat)
+    server.route('GET', '/history', history.handle_history)
+    # Transcripts, the outbox and the span log hold every user's messages
+    server.protect(history.directory, archive.path, tracing.SPAN_LOG)
+    
+    print(f"\n🚀 DataSenderApp Backend Server")
+    print(f"📍 Local: http://localhost:{PORT}")
+    print(f"📱 Network: http://YOUR_IP:{PORT}")
+    print(f"\n✨ Claude CLI integration active")
+    print(f"🌐 Open http://localhost:{PORT} in your browser\n")
+    
+    server.serve_forever()
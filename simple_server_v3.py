@@ -4,175 +4,618 @@ Simple backend server for DataSenderApp - Version 3
 Uses Claude CLI in print mode for each message
 """
 
-import http.server
-import socketserver
-import subprocess
+import asyncio
 import json
-import threading
-import queue
+import os
 import time
 import sys
+import uuid
+from collections import Counter
 from urllib.parse import parse_qs
 
+from async_server import (AsyncChatServer, BadRequest, DEFAULT_SESSION, Response,
+                          json_response, start_response)
+from event_bus import EventBus, SessionChannel
+from websocket import serve_websocket
+from worker_pool import WorkerPool, PoolFull
+from scheduler import Scheduler, RateLimited, INTERACTIVE, BATCH
+from stream_reader import StreamReader
+from coalescer import Coalescer, MAX_SIZE
+import metrics
+import prefork
+import supervisor
+import tracing
+from response_cache import ResponseCache, cache_key
+from single_flight import SingleFlight
+from agents import Agents, HANDOFF
+from transcripts import TranscriptStore
+from context import Conversations, Discard
+from outbox import Outbox, device
+from uploads import Upload, UploadAborted, UploadStalled, UploadTooLarge, MAX_UPLOAD
+
 # Message queues
-from_claude = queue.Queue()
+from_claude = EventBus()
+
+# Active processes: queued or running prompts and the processIds sharing them
+flights = SingleFlight(from_claude)
+interrupts = metrics.counter('datasender_interrupts_total', 'Interrupt requests')
+
+# Print-mode workers, created in __main__
+pool = None
+
+# Complete answers by prompt, created in __main__
+cache = None
+
+# Multi-agent pipelines on the worker pool, created in __main__
+agents = None
 
-# Active processes
-active_processes = {}
+# Connection to the prefork event hub (prefork workers only), created in __main__
+link = None
 
-def process_message(message, process_id):
-    """Process a single message with Claude CLI"""
+# Durable per-session transcripts behind /history, created in __main__
+history = None
+
+# Messages on their way to the Supabase archive, created in __main__
+archive = None
+
+# Recent turns and running summary per session, created in __main__
+conversations = None
+
+# Limits for POST /batch
+MAX_BATCH = 500
+MAX_BATCH_CONCURRENCY = 8
+
+def process_message(proc, message, flight):
+    """Process a single message on a pre-warmed `claude --print` process"""
+    trace = flight.trace
     try:
+        # Waiting in the admission queue, handoff to a worker thread, acquiring a process
+        trace.since('queued', 'queue')
+        spawn_started, spawned = proc.spawn_times
+        if spawn_started >= trace.marks.get('queued', spawned):
+            # No warm process was left, so this message waited for a cold start
+            trace.span('spawn', spawn_started, spawned)
+        
+        # Store process for potential interruption
+        flight.proc = proc
+        if flight.cancelled:
+            # Every processId was interrupted while the message was queued
+            supervisor.kill(proc)
+            proc.wait()
+            return
+        
         # Update status
-        from_claude.put({'type': 'status', 'message': 'thinking'})
+        flight.emit({'type': 'status', 'message': 'thinking'})
         
-        # Run Claude with --print flag for single response
-        proc = subprocess.Popen(
-            ['claude', '--print', message],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True
-        )
+        # The worker is already running and waiting for its prompt on stdin
+        if isinstance(message, Upload):
+            # Streamed in as the client sends it (POST /upload)
+            message.write_to(proc.stdin)
+        else:
+            proc.stdin.write(message)
+        proc.stdin.close()
+        trace.mark('sent')
+        sent_at = trace.marks['sent']
         
-        # Store process for potential interruption
-        active_processes[process_id] = proc
+        # Stream output: first bytes at once, then coalesced batches
+        def send(text):
+            if text.strip():
+                flight.emit({'type': 'response', 'message': text.strip()})
+        
+        coalescer = Coalescer(send)
+        output = []
         
-        # Read output
-        output = ""
-        while True:
-            line = proc.stdout.readline()
-            if not line:
-                break
-            output += line
-            # Send incremental updates
-            if len(output) > 50:  # Send chunks
-                from_claude.put({'type': 'response', 'message': output.strip()})
-                output = ""
+        def on_output(text):
+            if not output:
+                trace.mark('first_output')
+                trace.since('sent', 'first_output')
+                metrics.FIRST_OUTPUT_SECONDS.observe(trace.marks['first_output'] - sent_at,
+                                                     mode='print')
+            output.append(text)
+            coalescer.write(text)
+        
+        StreamReader(proc.stdout, on_output).run()
         
         # Send final output
-        if output:
-            from_claude.put({'type': 'response', 'message': output.strip()})
+        coalescer.flush()
         
         # Wait for process to complete
         proc.wait()
+        trace.since('sent', 'cli', returncode=proc.returncode)
+        flight.returncode = proc.returncode
+        flight.output = ''.join(output)
+        metrics.RESPONSE_SECONDS.observe(time.monotonic() - sent_at, mode='print')
         
-        # Clean up
-        if process_id in active_processes:
-            del active_processes[process_id]
+        # Only complete, successful answers are worth replaying
+        if flight.key and not flight.cancelled and proc.returncode == 0:
+            cache.put(flight.key, ''.join(output))
             
+    except UploadAborted as e:
+        # The client went away or went over the limit; the prompt is incomplete
+        supervisor.kill(proc)
+        proc.wait()
+        flight.emit({'type': 'error', 'message': str(e)})
+        flight.error = str(e)
     except Exception as e:
         print(f"Error processing message: {e}", flush=True)
-        from_claude.put({'type': 'error', 'message': str(e)})
-
-class ChatHandler(http.server.SimpleHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/':
-            self.path = '/realtime_chat.html'
-        elif self.path == '/events':
-            # Server-Sent Events for real-time updates
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/event-stream')
-            self.send_header('Cache-Control', 'no-cache')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            
-            print("Client connected to /events", flush=True)
-            
-            # Send initial connection status
-            event = f"data: {json.dumps({'type': 'status', 'message': 'connected'})}\n\n"
-            self.wfile.write(event.encode())
-            self.wfile.flush()
-            
-            # Send updates
-            while True:
-                try:
-                    data = from_claude.get(timeout=30)  # 30 second timeout
-                    event = f"data: {json.dumps(data)}\n\n"
-                    self.wfile.write(event.encode())
-                    self.wfile.flush()
-                except queue.Empty:
-                    # Send heartbeat
-                    self.wfile.write(b"data: {\"type\": \"heartbeat\"}\n\n")
-                    self.wfile.flush()
-                except Exception as e:
-                    print(f"SSE error: {e}", flush=True)
-                    break
-            return
+        flight.emit({'type': 'error', 'message': str(e)})
+        flight.error = str(e)
+    finally:
+        if isinstance(message, Upload):
+            # Nothing reads the rest of the body once the CLI is done or gone
+            message.abort()
+        # Clean up
+        finish_flight(flight)
+
+def finish_flight(flight):
+    """The run is over (or never started): release it and end its traces"""
+    flights.finish(flight)
+    for joined in list(flight.traces.values()):
+        joined.end(cancelled=flight.cancelled)
+
+def stop_flight(flight):
+    """No processId is waiting for this flight any more"""
+    if pool.cancel(flight):
+        # Still queued: dropped without ever starting a CLI process
+        finish_flight(flight)
+    else:
+        flight.cancel()
+
+def process_id_of(data, required=False):
+    """The request's processId, a new one if it has none; raises BadRequest"""
+    process_id = data.get('processId')
+    if process_id is None and not required:
+        return str(time.time())
+    if not isinstance(process_id, str) or not process_id:
+        raise BadRequest("processId must be a non-empty string")
+    return process_id
+
+def client_of(request, data):
+    """Who a request counts against for fair queuing and rate limits"""
+    peer = request.writer.get_extra_info('peername') or ('-',)
+    return data.get('session') or peer[0]
+
+def replay_cached(response, process_id, trace):
+    """Stream a cached answer as the same events a live CLI run produces"""
+    from_claude.put(tracing.tag({'type': 'status', 'message': 'thinking',
+                                 'processId': process_id}, trace))
+    for start in range(0, len(response), MAX_SIZE):
+        chunk = response[start:start + MAX_SIZE]
+        if chunk.strip():
+            from_claude.put(tracing.tag({'type': 'response', 'message': chunk.strip(),
+                                         'processId': process_id}, trace))
+
+async def handle_chat(request):
+    data = request.json()
+    
+    message = data.get('message', '')
+    if not isinstance(message, str) or not message.strip():
+        return json_response({'status': 'error', 'message': 'message must be a non-empty string'},
+                             400)
+    process_id = process_id_of(data)
+    session = data.get('session') or DEFAULT_SESSION
+    
+    print(f"Received from client: {message}", flush=True)
+    
+    # The trace id travels with processId into every event of this request
+    trace = tracing.tracer.start(data.get('traceId') or request.headers.get('x-trace-id'),
+                                 started=request.received, processId=process_id)
+    accepted = {'status': 'processing', 'processId': process_id, 'traceId': trace.id}
+    history.record_user(data.get('session'), message, process_id)
+    archive.add(f"[REALTIME_CHAT] {message}", source='realtime_chat', device=device(request))
+    # Earlier turns of the session travel with the message unless the client opts out
+    prompt = conversations.prompt(session, message) if data.get('context', True) else message
+    try:
+        # Serve repeated prompts from the cache unless the client opts out. A prompt
+        # with context is never repeated - the turns in it change with every
+        # reply - so only messages sent as they are go through the cache and
+        # single-flight: a lookup could not hit, and an entry would never be read.
+        key = None
+        if prompt == message and data.get('cache', True) and request.query.get('nocache') != '1':
+            key = cache_key(prompt, pool.command[1:])
+            cached = cache.get_memory(key)
+            if cached is None:
+                # The disk tier may wait on SQLite; keep that off the event loop
+                cached = await asyncio.get_running_loop().run_in_executor(None, cache.get, key)
+            if cached is not None:
+                print(f"Cache hit for process {process_id}", flush=True)
+                replay_cached(cached, process_id, trace)
+                trace.end(cached=True)
+                conversations.record(session, message, cached)
+                return accepted
         
-        return super().do_GET()
-    
-    def do_POST(self):
-        print(f"POST request to: {self.path}", flush=True)
-        if self.path == '/chat':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data)
-            
-            message = data.get('message', '')
-            process_id = data.get('processId', str(time.time()))
-            
-            print(f"Received from client: {message}", flush=True)
+        def remember(flight):
+            if not flight.cancelled and flight.error is None and flight.returncode == 0:
+                conversations.record(session, message, flight.output)
+        
+        # An identical prompt already in flight: share its output
+        flight, leader = flights.join(key, process_id, trace)
+        if not leader:
+            print(f"Process {process_id} joined an identical in-flight prompt", flush=True)
+            return accepted
+        # One run is one turn, however many processIds share it; the flight cannot
+        # finish before it is submitted below
+        flight.callbacks.append(remember)
+        
+        # Hand the message to the worker pool (bounded, no thread per request)
+        trace.mark('queued')
+        try:
+            pool.submit(prompt, flight, client=client_of(request, data), lane=INTERACTIVE,
+                        job_id=flight, cost=1 + len(prompt) // 4096)
+        except PoolFull as e:
+            print(f"Rejecting message, pool is full: {e}", flush=True)
+            flights.leave(process_id)
+            trace.end(status='busy')
+            return json_response({'status': 'busy', 'processId': process_id}, 503)
+        except RateLimited as e:
+            print(f"Rejecting message: {e}", flush=True)
+            flights.leave(process_id)
+            trace.end(status='rate limited')
+            return rate_limited(e, process_id)
+        
+        return accepted
+    finally:
+        trace.span('http', request.received)
+
+async def handle_upload(request):
+    """Stream a raw or chunked body into a CLI's stdin, reporting progress over /events"""
+    query = request.query
+    body = request.body_stream
+    process_id = query.get('processId', str(time.time()))
+    if body.length is not None and body.length > MAX_UPLOAD:
+        return json_response({'status': 'error', 'processId': process_id,
+                              'message': f'upload over {MAX_UPLOAD} bytes'}, 413)
+    
+    trace = tracing.tracer.start(query.get('traceId') or request.headers.get('x-trace-id'),
+                                 started=request.received, processId=process_id)
+    # Uploads are never cached or shared with another run
+    flight, _ = flights.join(None, process_id, trace)
+    instruction = query.get('message', '')
+    upload = Upload(instruction + '\n\n' if instruction else '',
+                    stopped=lambda: flight.cancelled or flight.error is not None)
+    size = 'chunked' if body.length is None else f"{body.length} bytes"
+    print(f"Upload {process_id}: {size}", flush=True)
+    history.record_user(query.get('session'), instruction, process_id, upload=body.length)
+    
+    trace.mark('queued')
+    try:
+        pool.submit(upload, flight, client=client_of(request, query), lane=INTERACTIVE,
+                    job_id=flight, cost=1 + (body.length or 0) // 4096)
+    except PoolFull as e:
+        print(f"Rejecting upload, pool is full: {e}", flush=True)
+        flights.leave(process_id)
+        trace.end(status='busy')
+        return json_response({'status': 'busy', 'processId': process_id}, 503)
+    except RateLimited as e:
+        flights.leave(process_id)
+        trace.end(status='rate limited')
+        return rate_limited(e, process_id)
+    
+    reported = [0]
+    
+    def progress(received):
+        # At most a few events a second, however small the chunks
+        now = time.monotonic()
+        if now - reported[0] >= 0.25:
+            reported[0] = now
+            flight.emit({'type': 'status', 'message': 'uploading', 'bytes': received,
+                         'total': body.length})
+    
+    try:
+        received = await upload.feed(body, MAX_UPLOAD, progress)
+    except (UploadTooLarge, UploadAborted, asyncio.IncompleteReadError, ConnectionError) as e:
+        if flights.leave(process_id) is flight and not flight.subscribers:
+            stop_flight(flight)
+        trace.end(status='aborted')
+        print(f"Upload {process_id} stopped after {upload.received} bytes: {e}", flush=True)
+        if isinstance(e, UploadTooLarge):
+            return json_response({'status': 'error', 'processId': process_id,
+                                  'message': str(e)}, 413)
+        if isinstance(e, UploadStalled):
+            # Checked first: stopping the stuck CLI may fail the flight as well
+            return json_response({'status': 'error', 'processId': process_id,
+                                  'message': str(e)}, 504)
+        if isinstance(e, UploadAborted) and flight.error is not None:
+            # The CLI failed or exited before taking the whole body
+            return json_response({'status': 'error', 'processId': process_id,
+                                  'message': flight.error}, 500)
+        if isinstance(e, UploadAborted) and flight.cancelled:
+            return {'status': 'interrupted', 'processId': process_id}
+        if isinstance(e, UploadAborted):
+            return json_response({'status': 'error', 'processId': process_id,
+                                  'message': str(e)}, 503)
+        return None
+    finally:
+        trace.span('upload', request.received)
+    
+    flight.emit({'type': 'status', 'message': 'uploaded', 'bytes': received})
+    return {'status': 'processing', 'processId': process_id, 'bytes': received,
+            'traceId': trace.id}
+
+def summarize(prompt, done):
+    """Run a context summary on the pool, behind interactive work; done(text or None)"""
+    process_id = f"context-{uuid.uuid4().hex[:8]}"
+    trace = tracing.tracer.start(processId=process_id, context=True)
+    
+    def finished(flight):
+        ok = not flight.cancelled and flight.error is None and flight.returncode == 0
+        done(flight.output if ok else None)
+    
+    # Nobody watches a summary: its events go nowhere
+    flight, _ = flights.join(None, process_id, trace, Discard(), finished)
+    trace.mark('queued')
+    try:
+        pool.submit(prompt, flight, client='context', lane=BATCH, job_id=flight,
+                    cost=1 + len(prompt) // 4096, limit=False)
+    except Exception:
+        flights.leave(process_id)
+        trace.end(status='rejected')
+        raise
+
+def rate_limited(error, process_id):
+    return Response(json.dumps({'status': 'rate limited', 'processId': process_id,
+                                'retryAfter': round(error.retry_after, 1)}), 429,
+                    headers=[('Retry-After', str(int(error.retry_after) + 1))])
+
+def handle_agents(request):
+    """Run one message through named agents, handing off or in parallel"""
+    data = request.json()
+    
+    message = data.get('message', '')
+    if not isinstance(message, str) or not message.strip():
+        return json_response({'status': 'error', 'message': 'message must be a non-empty string'},
+                             400)
+    process_id = process_id_of(data)
+    roles = data.get('agents', ['consultant', 'coder'])
+    mode = data.get('mode', HANDOFF)
+    try:
+        # Before anything is recorded: a rejected request leaves no trace in the history
+        agents.check(roles, mode)
+    except ValueError as e:
+        return json_response({'status': 'error', 'message': str(e)}, 400)
+    print(f"Received for agents {roles} ({mode}): {message}", flush=True)
+    history.record_user(data.get('session'), message, process_id, agents=roles)
+    
+    try:
+        pipeline = agents.start(message, roles, mode, process_id,
+                                data.get('session') or DEFAULT_SESSION,
+                                client_of(request, data), started=request.received)
+    except ValueError as e:
+        return json_response({'status': 'error', 'message': str(e)}, 400)
+    except PoolFull as e:
+        print(f"Rejecting pipeline, pool is full: {e}", flush=True)
+        return json_response({'status': 'busy', 'processId': process_id}, 503)
+    except RateLimited as e:
+        return rate_limited(e, process_id)
+    
+    return {'status': 'processing', 'processId': process_id, 'mode': mode,
+            'agents': {role: pipeline.stage_id(role) for role in roles}}
+
+def interrupt(process_id):
+    """Stop (or detach) a processId; False if it is not running in this process"""
+    if agents.cancel(process_id):
+        print(f"Interrupted pipeline: {process_id}", flush=True)
+        return True
+    flight = flights.leave(process_id)
+    if flight is None:
+        return False
+    if flight.subscribers:
+        print(f"Detached {process_id}; shared process keeps running", flush=True)
+    else:
+        stop_flight(flight)
+        print(f"Interrupted process: {process_id}", flush=True)
+    return True
+
+def handle_interrupt(request):
+    data = request.json()
+    
+    process_id = process_id_of(data, required=True)
+    interrupts.inc()
+    if not interrupt(process_id) and link is not None:
+        # Started through another prefork worker, if at all
+        link.control({'type': 'interrupt', 'processId': process_id})
+    
+    return {'status': 'interrupted'}
+
+def on_control(data):
+    """Control messages from other prefork workers"""
+    if data.get('type') == 'interrupt':
+        interrupt(data.get('processId'))
+    elif data.get('type') == 'transcript' and history.forward is None:
+        history.record(data['record'])
+    elif data.get('type') == 'context':
+        conversations.apply(data['change'])
+
+async def handle_batch(request):
+    """Run a list of prompts; stream one NDJSON result per prompt as each completes"""
+    try:
+        data = request.json()
+        if not isinstance(data.get('prompts'), list):
+            raise ValueError("prompts must be a list")
+        prompts = [p if isinstance(p, dict) else {'message': p} for p in data['prompts']]
+        for index, prompt in enumerate(prompts):
+            # Checked before the 200 goes out; a bad item cannot fail mid-stream
+            if not isinstance(prompt.get('message'), str) or not prompt['message'].strip():
+                raise ValueError(f"prompt {index} needs a non-empty message string")
+            if not isinstance(prompt.get('processId') or '', str):
+                raise ValueError(f"prompt {index} has a processId that is not a string")
+        concurrency = max(1, min(int(data.get('concurrency', 4)), MAX_BATCH_CONCURRENCY))
+        timeout = float(data.get('timeout', 300))
+    except (ValueError, KeyError, TypeError) as e:
+        return json_response({'status': 'error', 'message': f'bad batch: {e}'}, 400)
+    if not 0 < len(prompts) <= MAX_BATCH:
+        return json_response({'status': 'error',
+                              'message': f'a batch holds 1 to {MAX_BATCH} prompts'}, 400)
+    
+    loop = asyncio.get_running_loop()
+    batch_id = data.get('batchId') or uuid.uuid4().hex[:8]
+    use_cache = data.get('cache', True) and request.query.get('nocache') != '1'
+    # Live events go to a session of their own, not into everyone's chat
+    events = SessionChannel(from_claude, data.get('session') or f'batch-{batch_id}')
+    client = client_of(request, data)
+    slots = asyncio.Semaphore(concurrency)
+    started = time.monotonic()
+    
+    async def run(index, prompt):
+        process_id = prompt.get('processId') or f'{batch_id}-{index}'
+        try:
+            return await attempt(index, prompt, process_id)
+        except Exception as e:
+            # One bad item must not end the stream for the others
+            print(f"Batch {batch_id}: prompt {index} failed: {e}", flush=True)
+            return {'type': 'result', 'index': index, 'processId': process_id,
+                    'status': 'error', 'message': str(e)}
+    
+    async def attempt(index, prompt, process_id):
+        message = prompt['message']
+        async with slots:
+            item_started = time.monotonic()
+            trace = tracing.tracer.start(started=item_started, processId=process_id,
+                                         batch=batch_id)
+            result = {'type': 'result', 'index': index, 'processId': process_id,
+                      'traceId': trace.id}
             
-            # Process message in background thread
-            thread = threading.Thread(
-                target=process_message, 
-                args=(message, process_id)
-            )
-            thread.daemon = True
-            thread.start()
+            key = cache_key(message, pool.command[1:]) if use_cache else None
+            cached = cache.get_memory(key) if key else None
+            if key and cached is None:
+                cached = await loop.run_in_executor(None, cache.get, key)
+            if cached is not None:
+                trace.end(cached=True)
+                return dict(result, status='ok', cached=True, response=cached, ms=0)
             
-            # Send response
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            response = {'status': 'processing', 'processId': process_id}
-            self.wfile.write(json.dumps(response).encode())
+            done = loop.create_future()
             
-        elif self.path == '/interrupt':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data)
+            def on_done(flight):
+                loop.call_soon_threadsafe(lambda: done.done() or done.set_result(flight))
             
-            process_id = data.get('processId')
-            if process_id in active_processes:
-                active_processes[process_id].terminate()
-                del active_processes[process_id]
-                print(f"Interrupted process: {process_id}", flush=True)
+            flight, leader = flights.join(key, process_id, trace, events, on_done)
+            deadline = item_started + timeout
+            try:
+                # The pool's queue is shared with /chat; wait for room and for tokens
+                trace.mark('queued')
+                while leader:
+                    try:
+                        pool.submit(message, flight, client=client, lane=BATCH,
+                                    job_id=flight, cost=1 + len(message) // 4096)
+                        break
+                    except (PoolFull, RateLimited) as e:
+                        if time.monotonic() >= deadline:
+                            raise asyncio.TimeoutError
+                        delay = e.retry_after if isinstance(e, RateLimited) else 0.05
+                        await asyncio.sleep(min(delay, deadline - time.monotonic()))
+                await asyncio.wait_for(asyncio.shield(done), deadline - time.monotonic())
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                # Stop the run unless another processId still shares it
+                if flights.leave(process_id) is flight and not flight.subscribers:
+                    stop_flight(flight)
+                trace.end(status='timeout')
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                return dict(result, status='timeout',
+                            ms=round((time.monotonic() - item_started) * 1000))
             
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            response = {'status': 'interrupted'}
-            self.wfile.write(json.dumps(response).encode())
-    
-    def do_OPTIONS(self):
-        # Handle CORS preflight
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
-    
-    def log_message(self, format, *args):
-        # Override to add flush
-        sys.stderr.write("%s - - [%s] %s\n" %
-                         (self.address_string(),
-                          self.log_date_time_string(),
-                          format%args))
-        sys.stderr.flush()
+            ms = round((time.monotonic() - item_started) * 1000)
+            if flight.error is not None or flight.returncode != 0:
+                return dict(result, status='error', ms=ms, returncode=flight.returncode,
+                            message=flight.error or flight.output)
+            return dict(result, status='ok', response=flight.output, ms=ms)
+    
+    writer = request.writer
+    start_response(writer, 200, [
+        ('Content-Type', 'application/x-ndjson'),
+        ('Cache-Control', 'no-cache'),
+        ('Connection', 'close'),
+        ('Access-Control-Allow-Origin', '*'),
+    ])
+    request.server.log(request, 200)
+    print(f"Batch {batch_id}: {len(prompts)} prompts, {concurrency} at a time", flush=True)
+    
+    tasks = [asyncio.ensure_future(run(i, p)) for i, p in enumerate(prompts)]
+    counts = Counter()
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            counts[result['status']] += 1
+            writer.write((json.dumps(result) + '\n').encode())
+            await writer.drain()
+        summary = {'type': 'summary', 'batchId': batch_id, 'total': len(prompts),
+                   'ok': counts['ok'], 'error': counts['error'], 'timeout': counts['timeout'],
+                   'ms': round((time.monotonic() - started) * 1000)}
+        writer.write((json.dumps(summary) + '\n').encode())
+        await writer.drain()
+    except ConnectionError:
+        print(f"Batch {batch_id}: client went away, cancelling", flush=True)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return None
+
+async def handle_cache_stats(request):
+    return await asyncio.get_running_loop().run_in_executor(None, cache.stats)
+
+def handle_cache_clear(request):
+    cache.clear()
+    return {'status': 'cleared'}
+
+def handle_context_stats(request):
+    return conversations.stats()
 
 if __name__ == '__main__':
-    PORT = 8082  # New port to avoid conflicts
+    PORT = int(os.environ.get('PORT', 8082))  # New port to avoid conflicts
+    
+    if prefork.WORKERS > 1 and not prefork.is_worker():
+        # WORKERS=N: this process only runs the event hub and the N workers
+        prefork.Parent(prefork.WORKERS).serve_forever()
+        sys.exit(0)
+    history = TranscriptStore()
+    conversations = Conversations(summarize if prefork.WORKER in (None, '0') else None)
+    # Every worker stores archive rows in the shared outbox; worker 0 sends them
+    archive = Outbox().start(send=prefork.WORKER in (None, '0'))
+    if prefork.is_worker():
+        link = prefork.Link(from_claude, on_control=on_control)
+    if prefork.WORKER in (None, '0'):
+        # Every event reaches every worker; worker 0 alone writes the transcripts
+        history.start()
+        from_claude.taps.append(history.record_event)
+    else:
+        history.forward = lambda record: link.control({'type': 'transcript', 'record': record})
+    if link is not None:
+        # Turns and summaries are copied to every worker; worker 0 writes the summaries
+        conversations.forward = lambda change: link.control({'type': 'context', 'change': change})
+    
+    # Keep CLI processes warm so a message never waits for process start-up
+    # Interactive messages before batch work, fair between clients, 2/s each (burst 20)
+    scheduler = Scheduler(maxsize=32, rate=float(os.environ.get('RATE_LIMIT', 2)), burst=20)
+    pool = WorkerPool(process_message, warm=2, max_workers=4, scheduler=scheduler).start()
+    cache = ResponseCache('response_cache.db')
+    agents = Agents(pool, flights, from_claude, stop_flight)
+    # Reap finished --print runs and anything they left running
+    supervisor.Supervisor().start()
     
     # Start web server
-    with socketserver.TCPServer(("", PORT), ChatHandler) as httpd:
+    server = AsyncChatServer(PORT, from_claude,
+                             greeting={'type': 'status', 'message': 'connected'},
+                             ready=pool.is_ready, reuse_port=prefork.is_worker())
+    server.route('GET', '/ws', serve_websocket)
+    server.route('POST', '/chat', handle_chat)
+    server.route('POST', '/interrupt', handle_interrupt)
+    server.route('POST', '/batch', handle_batch)
+    server.route('POST', '/upload', handle_upload, stream=True)
+    server.route('GET', '/history', history.handle_history)
+    # Transcripts, the outbox and the span log hold every user's messages
+    server.protect(history.directory, archive.path, tracing.SPAN_LOG, cache.path)
+    server.route('POST', '/agents', handle_agents)
+    server.route('GET', '/cache/stats', handle_cache_stats)
+    server.route('POST', '/cache/clear', handle_cache_clear)
+    server.route('GET', '/context/stats', handle_context_stats)
+    
+    if prefork.WORKER in (None, '0'):
         print(f"\n🚀 DataSenderApp Backend Server v3")
         print(f"📍 Local: http://localhost:{PORT}")
         print(f"📱 Network: http://YOUR_IP:{PORT}")
         print(f"\n✨ Claude CLI in print mode (one response per message)")
         print(f"🌐 Open http://localhost:{PORT} in your browser\n")
         sys.stdout.flush()
-        
-        httpd.serve_forever()
\ No newline at end of file
+    
+    server.serve_forever()
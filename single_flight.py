@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Single-flight coalescing of identical in-flight prompts
+When a prompt arrives that is identical to one already queued or running,
+its processId attaches to the existing run instead of starting a new CLI
+process. Every attached processId receives the full output (events
+emitted before it joined are replayed), and the shared process is only
+stopped once the last processId has been interrupted.
+"""
+
+import threading
+
+import supervisor
+import tracing
+
+class Flight:
+    """One queued or running prompt and the processIds waiting on it"""
+
+    def __init__(self, key, events):
+        self.key = key
+        self.events = events
+        self.subscribers = []
+        self.emitted = []  # every event so far, replayed to late joiners
+        self.proc = None
+        self.trace = None  # the leader's trace, for the stages of the shared run
+        self.traces = {}  # processId -> its Trace
+        self.cancelled = False
+        # Outcome, set by the worker before finish()
+        self.output = None
+        self.returncode = None
+        self.error = None
+        self.callbacks = []  # on_done(flight) of each join, called by finish()
+        self.channels = {}  # processId -> where its events go, if not the shared bus
+        self.events_lock = threading.Lock()
+
+    def emit(self, data):
+        """Publish an event once per attached processId"""
+        with self.events_lock:
+            self.emitted.append(data)
+            for process_id in self.subscribers:
+                events = self.channels.get(process_id, self.events)
+                events.put(tracing.tag(dict(data, processId=process_id),
+                                       self.traces.get(process_id)))
+
+    def cancel(self):
+        """Stop the run: skipped if still queued, terminated if running"""
+        self.cancelled = True
+        if self.proc is not None and self.proc.poll() is None:
+            supervisor.terminate(self.proc)
+
+class SingleFlight:
+    """Registry of in-flight prompts by key"""
+
+    def __init__(self, events):
+        self.events = events
+        self.flights = {}
+        self.by_process = {}
+        self._lock = threading.Lock()
+
+    def join(self, key, process_id, trace=None, events=None, on_done=None):
+        """Attach to the flight for key; returns (flight, started_new_flight)
+
+        events overrides where this processId's events are published, and
+        on_done(flight) is called from the worker thread when the run is over.
+        """
+        with self._lock:
+            flight = self.flights.get(key) if key is not None else None
+            leader = flight is None
+            if leader:
+                flight = Flight(key, self.events)
+                flight.trace = trace
+                if key is not None:
+                    self.flights[key] = flight
+            with flight.events_lock:
+                for data in flight.emitted:
+                    (events or self.events).put(
+                        tracing.tag(dict(data, processId=process_id), trace))
+                flight.subscribers.append(process_id)
+                if trace is not None:
+                    flight.traces[process_id] = trace
+                if events is not None:
+                    flight.channels[process_id] = events
+                if on_done is not None:
+                    flight.callbacks.append(on_done)
+            self.by_process[process_id] = flight
+            return flight, leader
+
+    def leave(self, process_id):
+        """Detach a processId; returns its flight (None if unknown)"""
+        with self._lock:
+            flight = self.by_process.pop(process_id, None)
+            if flight is None:
+                return None
+            with flight.events_lock:
+                if process_id in flight.subscribers:
+                    flight.subscribers.remove(process_id)
+                if not flight.subscribers:
+                    flight.cancelled = True
+                    self._forget(flight)
+            return flight
+
+    def finish(self, flight):
+        """The run is over; later identical prompts start a new flight"""
+        with self._lock:
+            self._forget(flight)
+            for process_id in flight.subscribers:
+                if self.by_process.get(process_id) is flight:
+                    del self.by_process[process_id]
+            # Nothing can join once the flight is forgotten
+            callbacks = list(flight.callbacks)
+        for callback in callbacks:
+            callback(flight)
+
+    def _forget(self, flight):
+        if flight.key is not None and self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
+
+    def __len__(self):
+        return len(self.flights)
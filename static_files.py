@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+In-memory static file cache for DataSenderApp
+Small files (the chat page, scripts, icons) are read once and kept in
+memory together with gzip - and brotli, if the brotli module is
+installed - variants compressed at load time. Every request re-checks the
+file's size and mtime, so edits show up at once. Each variant has a strong
+ETag, so a reload with If-None-Match is answered 304 without a body.
+Larger files are not cached; the server sends them with os.sendfile.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Files above this size are streamed from disk instead of cached
+MAX_CACHED_FILE = 256 * 1024
+
+# Types worth compressing; images, audio and archives already are
+COMPRESSIBLE = ('text/', 'application/json', 'application/javascript', 'application/xml',
+                'image/svg+xml')
+
+class StaticFile:
+    """One file's metadata and, if cached, its body per content encoding"""
+
+    def __init__(self, path, stat, body=None):
+        self.path = path
+        self.version = (stat.st_size, stat.st_mtime_ns)
+        self.size = stat.st_size
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.variants = {}
+        if body is None:
+            # Streamed from disk; size and mtime stand in for the content
+            self.tag = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+            return
+        self.tag = hashlib.sha1(body).hexdigest()[:20]
+        self.variants['identity'] = body
+        if self.content_type.startswith(COMPRESSIBLE) and len(body) > 256:
+            self._add('gzip', gzip.compress(body, 9, mtime=0))
+            if brotli is not None:
+                self._add('br', brotli.compress(body))
+
+    def _add(self, encoding, body):
+        if len(body) < len(self.variants['identity']):
+            self.variants[encoding] = body
+
+    @property
+    def cached(self):
+        return bool(self.variants)
+
+    def negotiate(self, accept_encoding):
+        """Best available encoding the client accepts"""
+        accepted = set()
+        for item in accept_encoding.split(','):
+            name, _, params = item.partition(';')
+            params = params.replace(' ', '')
+            try:
+                q = float(params[2:]) if params.startswith('q=') else 1
+            except ValueError:
+                q = 1
+            if q > 0:
+                accepted.add(name.strip().lower())
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and encoding in accepted:
+                return encoding
+        return 'identity'
+
+    def etag(self, encoding='identity'):
+        suffix = '' if encoding == 'identity' else f"-{encoding}"
+        return f'"{self.tag}{suffix}"'
+
+class StaticCache:
+    """LRU of StaticFiles by path, bounded by total cached bytes"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_file=MAX_CACHED_FILE):
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self.files = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.loads = 0
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """The cached file if it is unchanged on disk, else None (then load() it)"""
+        with self._lock:
+            entry = self.files.get(path)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        if stat is None or entry.version != (stat.st_size, stat.st_mtime_ns):
+            self._forget(path)
+            return None
+        with self._lock:
+            if path in self.files:
+                self.files.move_to_end(path)
+            self.hits += 1
+        return entry
+
+    def load(self, path):
+        """Read (and compress) a file; None if it is not a regular file. Blocking."""
+        try:
+            stat = os.stat(path)
+            if not os.path.isfile(path):
+                return None
+            body = None
+            if stat.st_size <= self.max_file:
+                with open(path, 'rb') as f:
+                    body = f.read()
+        except OSError:
+            return None
+        entry = StaticFile(path, stat, body)
+        if body is not None and len(body) != stat.st_size:
+            # Changed while being read; serve it, but do not cache it
+            return entry
+        with self._lock:
+            self.loads += 1
+            self._forget_locked(path)
+            self.files[path] = entry
+            self.bytes += _weight(entry)
+            while self.bytes > self.max_bytes and len(self.files) > 1:
+                _, oldest = self.files.popitem(last=False)
+                self.bytes -= _weight(oldest)
+        return entry
+
+    def _forget(self, path):
+        with self._lock:
+            self._forget_locked(path)
+
+    def _forget_locked(self, path):
+        entry = self.files.pop(path, None)
+        if entry is not None:
+            self.bytes -= _weight(entry)
+
+    def stats(self):
+        with self._lock:
+            return {'files': len(self.files), 'bytes': self.bytes,
+                    'hits': self.hits, 'loads': self.loads}
+
+def _weight(entry):
+    return sum(len(body) for body in entry.variants.values())
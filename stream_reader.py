@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Chunked non-blocking reader for Claude CLI output
+Reads the raw pipe file descriptor in large chunks instead of one
+character per select/read pair, decodes UTF-8 incrementally (a multibyte
+character split across reads is held back, never mangled) and frames the
+text by newline, or by size/time thresholds for partial lines.
+
+Run directly to compare it with the old one-character read loop:
+    python3 stream_reader.py [megabytes]
+"""
+
+import codecs
+import os
+import select
+import subprocess
+import sys
+import time
+
+class StreamReader:
+    """Frames a pipe's output and calls on_frame(text) for each frame"""
+
+    def __init__(self, stream, on_frame, chunk_size=65536, max_size=4096, max_delay=0.05):
+        self.fd = stream if isinstance(stream, int) else stream.fileno()
+        self.on_frame = on_frame
+        self.chunk_size = chunk_size
+        self.max_size = max_size    # emit a partial line once it gets this long
+        self.max_delay = max_delay  # ...or once it has waited this many seconds
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.pending = ''
+        self.pending_since = None
+        self.bytes = 0
+        self.frames = 0
+        self.reads = 0
+        self.selects = 0
+        self.started = None
+        self.finished = None
+
+    def run(self, duration=None):
+        """Read until EOF (or for duration seconds); returns True at EOF"""
+        os.set_blocking(self.fd, False)
+        self.started = self.started or time.monotonic()
+        stop_at = time.monotonic() + duration if duration is not None else None
+        try:
+            while True:
+                now = time.monotonic()
+                if stop_at is not None and now >= stop_at:
+                    return False
+                # Block indefinitely when nothing is pending: no CPU while idle
+                timeout = None
+                if self.pending_since is not None:
+                    timeout = max(0, self.pending_since + self.max_delay - now)
+                if stop_at is not None:
+                    timeout = stop_at - now if timeout is None else min(timeout, stop_at - now)
+
+                self.selects += 1
+                ready, _, _ = select.select([self.fd], [], [], timeout)
+                if not ready:
+                    self._flush_partial()
+                    continue
+
+                try:
+                    data = os.read(self.fd, self.chunk_size)
+                except BlockingIOError:
+                    continue
+                self.reads += 1
+                if not data:
+                    self.feed_text(self.decoder.decode(b'', final=True))
+                    self._flush_partial()
+                    return True
+                self.bytes += len(data)
+                self.feed_text(self.decoder.decode(data))
+        finally:
+            self.finished = time.monotonic()
+
+    def feed_text(self, text):
+        if not text:
+            return
+        if self.pending_since is None:
+            self.pending_since = time.monotonic()
+        self.pending += text
+        cut = self.pending.rfind('\n')
+        if cut >= 0:
+            # Every complete line read so far goes out as one frame
+            self._emit(self.pending[:cut + 1])
+            self.pending = self.pending[cut + 1:]
+            self.pending_since = time.monotonic() if self.pending else None
+        while len(self.pending) >= self.max_size:
+            self._emit(self.pending[:self.max_size])
+            self.pending = self.pending[self.max_size:]
+            if not self.pending:
+                self.pending_since = None
+
+    def _flush_partial(self):
+        if self.pending:
+            self._emit(self.pending)
+        self.pending = ''
+        self.pending_since = None
+
+    def _emit(self, text):
+        self.frames += 1
+        self.on_frame(text)
+
+    def stats(self):
+        elapsed = ((self.finished or time.monotonic()) - self.started) if self.started else 0
+        return {
+            'bytes': self.bytes,
+            'frames': self.frames,
+            'reads': self.reads,
+            'selects': self.selects,
+            'syscalls': self.reads + self.selects,
+            'seconds': round(elapsed, 3),
+            'bytes_per_second': round(self.bytes / elapsed) if elapsed else 0,
+        }
+
+def _char_loop(proc):
+    """The old path: one select and one read(1) per character"""
+    stats = {'bytes': 0, 'frames': 0, 'syscalls': 0}
+    buffer = ""
+    start = time.monotonic()
+    while True:
+        ready, _, _ = select.select([proc.stdout], [], [], 0.1)
+        stats['syscalls'] += 1
+        if not ready:
+            continue
+        char = proc.stdout.read(1)
+        stats['syscalls'] += 1
+        if not char:
+            break
+        stats['bytes'] += len(char.encode())
+        buffer += char
+        if char == '\n' or len(buffer) > 100:
+            stats['frames'] += 1
+            buffer = ""
+    elapsed = time.monotonic() - start
+    stats['seconds'] = round(elapsed, 3)
+    stats['bytes_per_second'] = round(stats['bytes'] / elapsed) if elapsed else 0
+    return stats
+
+def _writer(megabytes):
+    line = 'Claude says: café — 漢字 ' * 4 + '\n'
+    return [sys.executable, '-c',
+            f"import sys; sys.stdout.write({line!r} * int({megabytes} * 1048576 // len({line!r}.encode())))"]
+
+if __name__ == '__main__':
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+    proc = subprocess.Popen(_writer(megabytes), stdout=subprocess.PIPE, text=True, bufsize=0)
+    old = _char_loop(proc)
+    proc.wait()
+
+    proc = subprocess.Popen(_writer(megabytes), stdout=subprocess.PIPE)
+    reader = StreamReader(proc.stdout, lambda text: None)
+    reader.run()
+    proc.wait()
+    new = reader.stats()
+
+    print(f"one-character loop: {old}")
+    print(f"chunked reader:     {new}")
+    if new['seconds'] and old['seconds']:
+        print(f"speed-up: {old['seconds'] / new['seconds']:.1f}x, "
+              f"syscalls: {old['syscalls']} -> {new['syscalls']}")
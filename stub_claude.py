@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Stub Claude CLI for offline testing and benchmarks
+Behaves like `claude` closely enough for the servers:
+  stub_claude.py --print "message"   stream a reply and exit
+  stub_claude.py --print < message   same, prompt read from stdin
+  stub_claude.py                     interactive, one reply per input line
+Run a server against it with CLAUDE_BIN=./stub_claude.py
+
+Reply shape is set through the environment (benchmark.py sets these):
+  STUB_TOKENS      tokens per reply (default 0: a single echo line)
+  STUB_TOKEN_SIZE  bytes per token, including the separator (default 4)
+  STUB_RATE        tokens per second, 0 for as fast as possible (default 0)
+  STUB_STARTUP     seconds to sleep before accepting input (default 0)
+  STUB_END         marker line printed after every reply (default none)
+"""
+
+import os
+import sys
+import time
+
+TOKENS = int(os.environ.get('STUB_TOKENS', 0))
+TOKEN_SIZE = max(1, int(os.environ.get('STUB_TOKEN_SIZE', 4)))
+RATE = float(os.environ.get('STUB_RATE', 0))
+STARTUP = float(os.environ.get('STUB_STARTUP', 0))
+END = os.environ.get('STUB_END', '')
+
+def reply(message):
+    out = sys.stdout
+    out.write(f"Stub reply to: {message.strip()}\n")
+    out.flush()
+    token = 'x' * (TOKEN_SIZE - 1)
+    for i in range(TOKENS):
+        # A line break every 16 tokens, like prose
+        out.write(token + ('\n' if i % 16 == 15 else ' '))
+        out.flush()
+        if RATE:
+            time.sleep(1 / RATE)
+    if TOKENS:
+        out.write('\n')
+    if END:
+        out.write(END + '\n')
+    out.flush()
+
+def main(args):
+    if STARTUP:
+        time.sleep(STARTUP)
+
+    if '--print' in args or '-p' in args:
+        prompt = [a for a in args if not a.startswith('-')]
+        reply(prompt[-1] if prompt else sys.stdin.read())
+        return 0
+
+    print("Stub Claude ready", flush=True)
+    for line in sys.stdin:
+        reply(line)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
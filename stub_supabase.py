@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Stub Supabase REST endpoint for offline testing of the archive outbox
+Accepts bulk inserts on POST /rest/v1/<table> the way PostgREST does and
+prints each stored row. GET / reports counts as JSON.
+Run a server against it with SUPABASE_URL=http://localhost:54321 and any
+non-empty SUPABASE_KEY
+
+Failures are set through the environment:
+  PORT          port to listen on (default 54321)
+  STUB_FAIL     fraction of requests answered 503 (default 0)
+  STUB_REJECT   rows whose content contains this text get a 400 (default none)
+  STUB_DELAY    seconds to wait before answering (default 0)
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+PORT = int(os.environ.get('PORT', 54321))
+FAIL = float(os.environ.get('STUB_FAIL', 0))
+REJECT = os.environ.get('STUB_REJECT', '')
+DELAY = float(os.environ.get('STUB_DELAY', 0))
+
+rows = []
+keys = set()
+counts = {'requests': 0, 'failed': 0, 'rejected': 0, 'duplicates': 0, 'connections': 0}
+lock = threading.Lock()
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real thing
+
+    def setup(self):
+        super().setup()
+        with lock:
+            counts['connections'] += 1
+
+    def do_GET(self):
+        with lock:
+            self._reply(200, dict(counts, rows=len(rows)))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        url = urlsplit(self.path)
+        if DELAY:
+            time.sleep(DELAY)
+        with lock:
+            counts['requests'] += 1
+            if not url.path.startswith('/rest/v1/') or not self.headers.get('apikey'):
+                return self._reply(401, {'message': 'No API key found in request'})
+            if random.random() < FAIL:
+                counts['failed'] += 1
+                return self._reply(503, {'message': 'stub failure'}, {'Retry-After': '1'})
+            try:
+                batch = json.loads(body)
+            except ValueError:
+                return self._reply(400, {'message': 'invalid JSON'})
+            batch = batch if isinstance(batch, list) else [batch]
+            if REJECT and any(REJECT in str(row.get('content', '')) for row in batch):
+                counts['rejected'] += 1
+                return self._reply(400, {'message': 'rejected by STUB_REJECT'})
+            # on_conflict=<column> with ignore-duplicates skips keys already stored
+            column = parse_qs(url.query).get('on_conflict', [None])[0]
+            for row in batch:
+                key = row.get(column) if column else None
+                if key is not None and key in keys:
+                    counts['duplicates'] += 1
+                    continue
+                keys.add(key)
+                rows.append(row)
+                print(f"stored: {row.get('content')}", flush=True)
+            self._reply(201, None)
+
+    def _reply(self, status, data, headers=None):
+        body = b'' if data is None else json.dumps(data).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', PORT), Handler)
+    print(f"Stub Supabase on http://localhost:{PORT}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Supervision of Claude CLI processes
+Every CLI runs in its own process group with optional RLIMIT_AS / RLIMIT_CPU
+caps (Linux), so stopping one also stops anything it started. The Supervisor
+thread restarts crashed session processes with exponential backoff (their
+queued messages wait for the new process), recycles a process after N
+messages or M MB of RSS once it is idle, and reaps finished children and
+whatever they left behind. Restarts and recycles are published as status
+events so clients can see why a conversation started over.
+No external dependencies - uses only Python standard library
+"""
+
+import os
+import signal
+import subprocess
+import threading
+import time
+import weakref
+
+import metrics
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+# Per-process caps (0 = none). The CLI is a Node program and reserves a lot
+# of address space up front, so RLIMIT_AS should be generous if set at all.
+MAX_MEMORY_MB = int(os.environ.get('CLAUDE_MAX_MEMORY_MB', 0))
+MAX_CPU_SECONDS = int(os.environ.get('CLAUDE_MAX_CPU_SECONDS', 0))
+
+# Recycle a session's process after this many messages or this much RSS (0 = never)
+RECYCLE_MESSAGES = int(os.environ.get('CLAUDE_RECYCLE_MESSAGES', 200))
+RECYCLE_RSS_MB = int(os.environ.get('CLAUDE_RECYCLE_RSS_MB', 1024))
+
+RESTARTS = metrics.counter('claude_restarts_total', 'CLI processes replaced by the supervisor',
+                           ('reason',))
+REAPED = metrics.counter('claude_reaped_total', 'Finished CLI processes reaped')
+
+# Every CLI started through spawn(), until it has been reaped
+_children = weakref.WeakSet()
+_children_lock = threading.Lock()
+
+def _limit_resources(pid, max_memory_mb, max_cpu_seconds):
+    # Set from outside once the child exists: preexec_fn is not safe in a threaded
+    # server. The CLI starts a moment before its caps apply, which is fine for caps
+    # meant to stop runaways.
+    try:
+        if max_memory_mb:
+            limit = max_memory_mb * 1024 * 1024
+            resource.prlimit(pid, resource.RLIMIT_AS, (limit, limit))
+        if max_cpu_seconds:
+            resource.prlimit(pid, resource.RLIMIT_CPU, (max_cpu_seconds, max_cpu_seconds + 5))
+    except ProcessLookupError:
+        pass  # already finished
+    except OSError as e:
+        print(f"Could not cap resources of process {pid}: {e}", flush=True)
+
+def spawn(command, max_memory_mb=MAX_MEMORY_MB, max_cpu_seconds=MAX_CPU_SECONDS, **kwargs):
+    """subprocess.Popen in a new process group, with resource caps (Linux only)"""
+    if os.name == 'posix':
+        kwargs['start_new_session'] = True
+    proc = subprocess.Popen(command, **kwargs)
+    if hasattr(resource, 'prlimit') and (max_memory_mb or max_cpu_seconds):
+        _limit_resources(proc.pid, max_memory_mb, max_cpu_seconds)
+    with _children_lock:
+        _children.add(proc)
+    return proc
+
+def _signal_group(proc, sig):
+    try:
+        if os.name == 'posix':
+            os.killpg(proc.pid, sig)
+        else:
+            proc.send_signal(sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def terminate(proc):
+    """SIGTERM the process and everything it started"""
+    _signal_group(proc, signal.SIGTERM)
+
+def kill(proc):
+    """SIGKILL the process and everything it started"""
+    _signal_group(proc, signal.SIGKILL)
+
+def reap():
+    """Collect finished children and kill anything left in their groups"""
+    with _children_lock:
+        children = list(_children)
+    reaped = 0
+    for proc in children:
+        if proc.poll() is None:
+            continue
+        # Orphans (tools the CLI started) keep the group alive after the CLI exits
+        kill(proc)
+        with _children_lock:
+            _children.discard(proc)
+        reaped += 1
+    if reaped:
+        REAPED.inc(reaped)
+    return reaped
+
+class Backoff:
+    """Exponential delays: base, base*factor, ... up to maximum"""
+
+    def __init__(self, base=0.5, factor=2, maximum=60):
+        self.base = base
+        self.factor = factor
+        self.maximum = maximum
+        self.attempts = 0
+
+    def next(self):
+        delay = min(self.base * self.factor ** self.attempts, self.maximum)
+        self.attempts += 1
+        return delay
+
+    def reset(self):
+        self.attempts = 0
+
+class Supervisor:
+    """Restarts, recycles and reaps the CLI processes of a SessionManager"""
+
+    def __init__(self, sessions=None, events=None, interval=2, max_messages=RECYCLE_MESSAGES,
+                 max_rss_mb=RECYCLE_RSS_MB, stable_after=60):
+        self.sessions = sessions  # None: only reap (print mode)
+        self.events = events
+        self.interval = interval
+        self.max_messages = max_messages
+        self.max_rss_mb = max_rss_mb
+        self.stable_after = stable_after  # a process up this long resets its backoff
+        self.backoff = {}  # session id -> (Backoff, earliest next restart)
+        self._wake = threading.Event()
+        self._running = False
+
+    def start(self):
+        self._running = True
+        if self.sessions is not None:
+            self.sessions.supervisor = self
+        thread = threading.Thread(target=self._run, name="supervisor")
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+
+    def wake(self):
+        """Check now instead of at the next interval (e.g. a message hit a dead session)"""
+        self._wake.set()
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Supervisor check failed: {e}", flush=True)
+
+    def check(self):
+        reap()
+        if self.sessions is None:
+            return
+        now = time.monotonic()
+        for session in self.sessions.live():
+            if not session.alive():
+                self._restart(session, 'crashed', now)
+                continue
+            if now - session.started >= self.stable_after:
+                self.backoff.pop(session.id, None)
+            # Recycling drops the conversation, so only between replies
+            if not session.idle(5):
+                continue
+            if self.max_messages and session.messages >= self.max_messages:
+                self._restart(session, 'recycled', now, f"{session.messages} messages")
+            elif self.max_rss_mb:
+                rss = metrics.process_rss(session.proc.pid) or 0
+                if rss >= self.max_rss_mb * 1024 * 1024:
+                    self._restart(session, 'recycled', now, f"{rss // (1024 * 1024)} MB RSS")
+
+    def _restart(self, session, reason, now, detail=None):
+        backoff, earliest = self.backoff.get(session.id, (None, 0))
+        if reason == 'crashed':
+            if now < earliest:
+                return
+            backoff = backoff or Backoff()
+            delay = backoff.next()
+            self.backoff[session.id] = (backoff, now + delay)
+            detail = f"exit code {session.proc.returncode}, next restart in {delay:g} s at the earliest"
+        print(f"Restarting Claude CLI [{session.id}]: {reason} ({detail})", flush=True)
+        try:
+            self.sessions.restart(session)
+        except OSError as e:
+            print(f"Could not restart Claude CLI [{session.id}]: {e}", flush=True)
+            return
+        RESTARTS.inc(reason=reason)
+        if self.events is not None:
+            self.events.put({'type': 'status',
+                             'message': 'recycled' if reason == 'recycled' else 'restarted',
+                             'reason': detail, 'session': session.id})
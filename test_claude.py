@@ -2,9 +2,10 @@
 """Test Claude CLI interaction"""
 
 import subprocess
-import time
 import sys
 
+from stream_reader import StreamReader
+
 # Start Claude
 proc = subprocess.Popen(
     ['claude'],
@@ -17,19 +18,15 @@ proc = subprocess.Popen(
 
 print("Claude started, reading initial output...")
 
+def show(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+# Read output in large chunks, framed by line or after 50ms
+reader = StreamReader(proc.stdout, show)
+
 # Read initial output with timeout
-start = time.time()
-initial = ""
-while time.time() - start < 3:
-    try:
-        # Read one character at a time
-        char = proc.stdout.read(1)
-        if char:
-            initial += char
-            sys.stdout.write(char)
-            sys.stdout.flush()
-    except:
-        break
+reader.run(duration=3)
 
 print("\n\nInitial output complete. Sending test message...")
 
@@ -42,17 +39,8 @@ print(f"Sent: {test_message}")
 print("Waiting for response...")
 
 # Read response
-response = ""
-start = time.time()
-while time.time() - start < 10:
-    try:
-        char = proc.stdout.read(1)
-        if char:
-            response += char
-            sys.stdout.write(char)
-            sys.stdout.flush()
-    except:
-        break
+reader.run(duration=10)
 
 print("\n\nTest complete.")
+print(f"Reader stats: {reader.stats()}")
 proc.terminate()
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""Retry policy of the Supabase archive outbox"""
+
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from outbox import Outbox
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.outbox = Outbox(path=os.path.join(self.tmp.name, 'outbox.db'),
+                             url='http://127.0.0.1:9', key='test', interval=60)
+        self.outbox.start(send=False)
+        self.posts = []  # bodies sent, as lists of contents
+
+    def tearDown(self):
+        self.outbox.db.close()
+        self.tmp.cleanup()
+
+    def store(self, *contents):
+        for content in contents:
+            self.outbox.add(content)
+        deadline = time.monotonic() + 5
+        while self.count() < len(contents) and time.monotonic() < deadline:
+            time.sleep(0.02)
+
+    def count(self, failed=None):
+        query = 'SELECT count(*) FROM outbox'
+        if failed is not None:
+            query += f' WHERE failed = {int(failed)}'
+        with self.outbox._lock:
+            return self.outbox.db.execute(query).fetchone()[0]
+
+    def answer(self, status, reject=None):
+        """Fake Supabase: every post gets status, or 201 unless a row contains reject"""
+        def post(body):
+            contents = [row['content'] for row in json.loads(body)]
+            self.posts.append(contents)
+            if reject is not None:
+                return (400 if any(reject in c for c in contents) else 201), 0
+            return status, 0
+        self.outbox._post = post
+
+    def test_accepted_rows_are_deleted(self):
+        self.store('a', 'b')
+        self.answer(201)
+        self.assertEqual(self.outbox.flush(), 0)
+        self.assertEqual(self.posts, [['a', 'b']])
+        self.assertEqual(self.count(), 0)
+
+    def test_config_errors_keep_rows_and_back_off(self):
+        self.store('a', 'b')
+        for status in (401, 403, 404, 429, 503):
+            self.answer(status)
+            self.assertGreater(self.outbox.flush(), 0, status)
+            self.assertEqual(self.count(failed=False), 2, status)
+        # Sent as one batch each time, never split or given up on
+        self.assertTrue(all(len(post) == 2 for post in self.posts))
+
+    def test_retry_after_is_honoured(self):
+        self.store('a')
+        self.outbox._post = lambda body: (503, 120)
+        self.assertGreaterEqual(self.outbox.flush(), 120)
+
+    def test_bad_row_is_found_and_kept_failed(self):
+        self.store('good', 'bad', 'fine')
+        self.answer(None, reject='bad')
+        self.assertEqual(self.outbox.flush(), 0)
+        self.assertEqual(self.posts, [['good', 'bad', 'fine'], ['good'], ['bad'], ['fine']])
+        self.assertEqual(self.count(), 1)
+        self.assertEqual(self.count(failed=True), 1)
+
+    def test_unreachable_keeps_rows(self):
+        self.store('a')
+        self.outbox.timeout = 1
+        self.assertGreater(self.outbox.flush(), 0)
+        self.assertEqual(self.count(failed=False), 1)
+
+    def test_disabled_without_key(self):
+        outbox = Outbox(path=os.path.join(self.tmp.name, 'off.db'),
+                        url='http://127.0.0.1:9', key='')
+        self.assertFalse(outbox.enabled)
+        self.assertIsNone(outbox.add('a'))
+
+if __name__ == '__main__':
+    unittest.main()
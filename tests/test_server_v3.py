@@ -0,0 +1,201 @@
+"""simple_server_v3.py end to end, against the stub CLI"""
+
+import base64
+import http.client
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import uuid
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class WebSocket:
+    """Just enough of a client: masked text frames out, JSON text frames in"""
+
+    def __init__(self, port, path='/ws?session=test'):
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=10)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall((f"GET {path} HTTP/1.1\r\nHost: localhost\r\n"
+                           "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                           f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+                           ).encode())
+        self.buffer = b''
+        while b'\r\n\r\n' not in self.buffer:
+            self.buffer += self._recv()
+        head, self.buffer = self.buffer.split(b'\r\n\r\n', 1)
+        self.status = int(head.split()[1])
+
+    def _recv(self):
+        chunk = self.sock.recv(65536)
+        if not chunk:
+            raise ConnectionError('closed by the server')
+        return chunk
+
+    def _read(self, n):
+        while len(self.buffer) < n:
+            self.buffer += self._recv()
+        data, self.buffer = self.buffer[:n], self.buffer[n:]
+        return data
+
+    def send(self, data):
+        payload = json.dumps(data).encode()
+        mask = os.urandom(4)
+        header = bytes([0x81])
+        if len(payload) < 126:
+            header += bytes([0x80 | len(payload)])
+        else:
+            header += bytes([0x80 | 126]) + struct.pack('>H', len(payload))
+        self.sock.sendall(header + mask +
+                          bytes(b ^ mask[i % 4] for i, b in enumerate(payload)))
+
+    def receive(self, *types):
+        """The next JSON frame whose type is one of types"""
+        while True:
+            first, second = self._read(2)
+            size = second & 0x7f
+            if size == 126:
+                size = struct.unpack('>H', self._read(2))[0]
+            elif size == 127:
+                size = struct.unpack('>Q', self._read(8))[0]
+            payload = self._read(size)
+            if first & 0x0f == 0x1:
+                data = json.loads(payload)
+                if data.get('type') in types:
+                    return data
+
+    def close(self):
+        self.sock.close()
+
+class ServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.port = free_port()
+        env = dict(os.environ, PORT=str(cls.port), CLAUDE_BIN=os.path.join(HERE, 'stub_claude.py'),
+                   TRANSCRIPT_DIR=os.path.join(cls.tmp.name, 'transcripts'),
+                   SPAN_LOG=os.path.join(cls.tmp.name, 'spans.jsonl'),
+                   SUPABASE_URL='', SUPABASE_KEY='', RATE_LIMIT='0', WORKERS='1')
+        # The cache and outbox files land in the working directory
+        cls.server = subprocess.Popen([sys.executable, os.path.join(HERE, 'simple_server_v3.py')],
+                                      cwd=cls.tmp.name, env=env, stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', cls.port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or cls.server.poll() is not None:
+                    cls.tearDownClass()
+                    raise RuntimeError('simple_server_v3.py did not start')
+                time.sleep(0.1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.wait(10)
+        cls.tmp.cleanup()
+
+    def request(self, method, path, body=None):
+        """(status, body text)"""
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        try:
+            if body is not None and not isinstance(body, (str, bytes)):
+                body = json.dumps(body)
+            conn.request(method, path, body, {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            return response.status, response.read().decode()
+        finally:
+            conn.close()
+
+    def post(self, path, body):
+        status, text = self.request('POST', path, body)
+        return status, json.loads(text.splitlines()[-1]) if text else None
+
+    def cache_stats(self):
+        return json.loads(self.request('GET', '/cache/stats')[1])
+
+    def wait_for_cache(self, puts):
+        deadline = time.monotonic() + 10
+        while self.cache_stats()['memory_entries'] < puts and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def test_bad_bodies_are_400(self):
+        for body in ('{not json', '[1, 2]', {'message': 'hi', 'processId': {'x': 1}},
+                     {'message': ''}, {'message': 5}):
+            status, _ = self.post('/chat', body)
+            self.assertEqual(status, 400, body)
+        self.assertEqual(self.post('/interrupt', {})[0], 400)
+
+    def test_batch_validation(self):
+        for prompts in ('abc', {'message': 'x'}, [], [5], [''], [{'message': 'x', 'processId': 3}]):
+            status, answer = self.post('/batch', {'prompts': prompts})
+            self.assertEqual(status, 400, prompts)
+            self.assertEqual(answer['status'], 'error')
+        self.assertEqual(self.post('/batch', {})[0], 400)
+
+    def test_batch_streams_every_result(self):
+        status, text = self.request('POST', '/batch',
+                                    {'prompts': ['one', {'message': 'two'}], 'cache': False})
+        self.assertEqual(status, 200)
+        lines = [json.loads(line) for line in text.splitlines()]
+        results = sorted((r['index'], r['status']) for r in lines if r['type'] == 'result')
+        self.assertEqual(results, [(0, 'ok'), (1, 'ok')])
+        self.assertEqual(lines[-1]['type'], 'summary')
+        self.assertEqual(lines[-1]['ok'], 2)
+
+    def test_repeated_message_is_served_from_cache(self):
+        message = f'cache test {uuid.uuid4()}'
+        entries = self.cache_stats()['memory_entries']
+        self.assertEqual(self.post('/chat', {'message': message, 'context': False})[0], 200)
+        self.wait_for_cache(entries + 1)
+        hits = self.cache_stats()['hits']
+        self.assertEqual(self.post('/chat', {'message': message, 'context': False})[0], 200)
+        self.assertEqual(self.cache_stats()['hits'], hits + 1)
+
+    def test_prompt_with_context_bypasses_cache(self):
+        session = f'context-{uuid.uuid4()}'
+        sessions = json.loads(self.request('GET', '/context/stats')[1])['sessions']
+        self.post('/chat', {'message': 'first', 'session': session})
+        deadline = time.monotonic() + 10
+        # The session exists once its first turn is recorded
+        while json.loads(self.request('GET', '/context/stats')[1])['sessions'] == sessions:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        before = self.cache_stats()
+        self.assertEqual(self.post('/chat', {'message': 'second', 'session': session})[0], 200)
+        time.sleep(0.5)
+        after = self.cache_stats()
+        self.assertEqual((after['hits'], after['misses'], after['memory_entries']),
+                         (before['hits'], before['misses'], before['memory_entries']))
+
+    def test_websocket_error_keeps_socket_open(self):
+        ws = WebSocket(self.port)
+        try:
+            self.assertEqual(ws.status, 101)
+            ws.send({'type': 'chat', 'message': 'hi', 'processId': {'x': 1}})
+            error = ws.receive('error', 'ack')
+            self.assertEqual((error['type'], error['request'], error['code']),
+                             ('error', 'chat', 400))
+            ws.send({'type': 'unknown'})
+            self.assertEqual(ws.receive('error', 'ack')['message'], 'unsupported message')
+            ws.send({'type': 'chat', 'message': 'still there?', 'processId': 'ws-1',
+                     'context': False})
+            ack = ws.receive('error', 'ack')
+            self.assertEqual((ack['type'], ack['code'], ack['processId']), ('ack', 200, 'ws-1'))
+        finally:
+            ws.close()
+
+if __name__ == '__main__':
+    unittest.main()
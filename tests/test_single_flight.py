@@ -0,0 +1,96 @@
+"""Response cache and single-flight coalescing"""
+
+import unittest
+
+from response_cache import ResponseCache, cache_key
+from single_flight import SingleFlight
+
+class Events:
+    """Collects what a flight publishes"""
+
+    def __init__(self):
+        self.items = []
+
+    def put(self, data):
+        self.items.append(data)
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(path=None, max_bytes=1000)
+
+    def test_key_ignores_whitespace_but_not_flags(self):
+        self.assertEqual(cache_key(' hello   world\n'), cache_key('hello world'))
+        self.assertNotEqual(cache_key('hello', ['--model', 'a']),
+                            cache_key('hello', ['--model', 'b']))
+
+    def test_hit_and_miss(self):
+        key = cache_key('question')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, 'answer')
+        self.assertEqual(self.cache.get_memory(key), 'answer')
+        self.assertEqual(self.cache.get(key), 'answer')
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    def test_memory_tier_is_bounded(self):
+        for n in range(20):
+            self.cache.put(cache_key(str(n)), 'x' * 100)
+        self.assertLessEqual(self.cache.memory_bytes, 1000)
+        self.assertIsNone(self.cache.get_memory(cache_key('0')))
+        self.assertEqual(self.cache.get_memory(cache_key('19')), 'x' * 100)
+
+    def test_huge_answer_is_not_kept(self):
+        self.cache.put('small', 'x' * 100)
+        self.cache.put('huge', 'x' * 600)
+        self.assertIsNone(self.cache.get_memory('huge'))
+        self.assertIsNotNone(self.cache.get_memory('small'))
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.events = Events()
+        self.flights = SingleFlight(self.events)
+
+    def test_identical_prompts_share_one_flight(self):
+        flight, leader = self.flights.join('k', 'a')
+        joined, second = self.flights.join('k', 'b')
+        self.assertTrue(leader)
+        self.assertFalse(second)
+        self.assertIs(joined, flight)
+        flight.emit({'type': 'response', 'message': 'hi'})
+        self.assertEqual([e['processId'] for e in self.events.items], ['a', 'b'])
+
+    def test_late_joiner_gets_earlier_events(self):
+        flight, _ = self.flights.join('k', 'a')
+        flight.emit({'type': 'thinking'})
+        self.flights.join('k', 'b')
+        self.assertEqual([(e['type'], e['processId']) for e in self.events.items],
+                         [('thinking', 'a'), ('thinking', 'b')])
+
+    def test_no_key_never_shares(self):
+        first, _ = self.flights.join(None, 'a')
+        second, leader = self.flights.join(None, 'b')
+        self.assertTrue(leader)
+        self.assertIsNot(first, second)
+
+    def test_finish_runs_callbacks_and_ends_sharing(self):
+        done = []
+        flight, _ = self.flights.join('k', 'a', on_done=done.append)
+        self.flights.join('k', 'b')
+        # handle_chat registers its turn once, for the leader only
+        self.assertEqual(len(flight.callbacks), 1)
+        self.flights.finish(flight)
+        self.assertEqual(done, [flight])
+        _, leader = self.flights.join('k', 'c')
+        self.assertTrue(leader)
+
+    def test_cancelled_only_when_everyone_left(self):
+        flight, _ = self.flights.join('k', 'a')
+        self.flights.join('k', 'b')
+        self.assertIs(self.flights.leave('a'), flight)
+        self.assertFalse(flight.cancelled)
+        self.flights.leave('b')
+        self.assertTrue(flight.cancelled)
+        self.assertIsNone(self.flights.leave('b'))
+        self.assertEqual(len(self.flights), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""Handler errors on the WebSocket turn into error frames, not HTTP responses"""
+
+import asyncio
+import json
+import unittest
+
+from async_server import BadRequest, json_response
+from websocket import handle_message
+
+class Socket:
+    """Collects the frames a handler sends"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_json(self, data):
+        self.sent.append(data)
+
+class Server:
+    def __init__(self, dispatch):
+        self.dispatch = dispatch
+
+class Request:
+    headers = {}
+    reader = None
+    writer = None
+
+def run(dispatch, message):
+    ws = Socket()
+    asyncio.run(handle_message(Server(dispatch), Request(), ws, 'default',
+                               json.dumps(message).encode()))
+    return ws.sent
+
+class HandleMessageTest(unittest.TestCase):
+    def test_ack_carries_the_handler_answer(self):
+        async def dispatch(request):
+            self.assertEqual(request.path, '/chat')
+            self.assertEqual(request.json()['session'], 'default')
+            return json_response({'status': 'processing', 'processId': 'p'})
+        sent = run(dispatch, {'type': 'chat', 'message': 'hi'})
+        self.assertEqual(sent, [{'status': 'processing', 'processId': 'p', 'type': 'ack',
+                                 'request': 'chat', 'code': 200}])
+
+    def test_bad_request_is_a_400_error_frame(self):
+        async def dispatch(request):
+            raise BadRequest('processId must be a non-empty string')
+        sent = run(dispatch, {'type': 'interrupt', 'processId': {}})
+        self.assertEqual(sent, [{'type': 'error', 'request': 'interrupt', 'code': 400,
+                                 'message': 'processId must be a non-empty string'}])
+
+    def test_handler_failure_is_a_500_error_frame(self):
+        async def dispatch(request):
+            raise RuntimeError('boom')
+        sent = run(dispatch, {'type': 'chat', 'message': 'hi'})
+        self.assertEqual(sent, [{'type': 'error', 'request': 'chat', 'code': 500,
+                                 'message': 'boom'}])
+
+    def test_unsupported_messages(self):
+        async def dispatch(request):
+            self.fail('dispatched')
+        for payload in ({'type': 'nope'}, ['chat'], 'chat'):
+            sent = run(dispatch, payload)
+            self.assertEqual(sent, [{'type': 'error', 'message': 'unsupported message'}])
+
+if __name__ == '__main__':
+    unittest.main()
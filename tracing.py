@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Request tracing and on-demand profiling for DataSenderApp
+Every /chat gets a trace id that travels with its processId (or session)
+into each event it produces. Timed spans for each stage - HTTP handling,
+queueing and the thread handoff, CLI start-up, first output, coalescing
+and delivery to a client - are appended to a rotating JSONL span log by a
+background thread, so the request path never waits on the disk.
+sample_stacks() is a sampling profiler for a live server: it snapshots
+every thread's stack at a fixed interval and returns collapsed stacks,
+ready for flamegraph.pl or speedscope.
+No external dependencies - uses only Python standard library
+"""
+
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+SPAN_LOG = os.environ.get('SPAN_LOG', 'spans.jsonl')
+
+class ProfilerBusy(Exception):
+    """A profile is already being taken"""
+
+class SpanLog:
+    """Appends spans as JSON lines, rotating path -> path.1 -> ... path.N"""
+
+    def __init__(self, path=SPAN_LOG, max_bytes=5 * 1024 * 1024, backups=3, max_pending=10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def write(self, span):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-log")
+                self._thread.daemon = True
+                self._thread.start()
+        try:
+            self.pending.put_nowait(span)
+        except queue.Full:
+            # Tracing must never slow the request path down
+            self.dropped += 1
+
+    def _run(self):
+        out = None
+        while True:
+            lines = [json.dumps(self.pending.get())]
+            # Write everything that queued up meanwhile in one go
+            while True:
+                try:
+                    lines.append(json.dumps(self.pending.get_nowait()))
+                except queue.Empty:
+                    break
+            try:
+                if out is None:
+                    out = open(self.path, 'a')
+                out.write('\n'.join(lines) + '\n')
+                out.flush()
+                if out.tell() >= self.max_bytes:
+                    out.close()
+                    out = None
+                    self._rotate()
+            except OSError as e:
+                print(f"Span log {self.path} failed: {e}", flush=True)
+                out = None
+
+    def _rotate(self):
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{n}"):
+                os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+class Trace:
+    """The spans of one /chat request"""
+
+    def __init__(self, tracer, trace_id, **attrs):
+        self.tracer = tracer
+        self.id = trace_id
+        self.attrs = attrs  # e.g. processId or session, copied into every span
+        self.wall = time.time()
+        self.started = time.monotonic()
+        self.marks = {}
+        self.delivered = set()
+        self.ended = False
+
+    def mark(self, name, at=None):
+        """Remember when a stage was reached; the first mark of a name wins"""
+        self.marks.setdefault(name, time.monotonic() if at is None else at)
+
+    def span(self, name, start, end=None, **attrs):
+        """Record a span from monotonic time start to end (default now)"""
+        end = time.monotonic() if end is None else end
+        self.tracer.log.write(dict(
+            self.attrs, trace=self.id, span=name,
+            start=round(self.wall + (start - self.started), 6),
+            ms=round((end - start) * 1000, 3), **attrs))
+
+    def since(self, mark, name, end=None, **attrs):
+        """Span from a mark to end (default now); nothing if the mark was never reached"""
+        start = self.marks.get(mark)
+        if start is not None:
+            self.span(name, start, end, **attrs)
+
+    def event(self, data):
+        """Tag event data with the trace id as it is published"""
+        if data.get('type') == 'response' and 'first_event' not in self.marks:
+            # Time the first output spent in the coalescer
+            self.since('first_output', 'coalesce')
+            self.mark('first_event')
+        data['traceId'] = self.id
+        return data
+
+    def deliver(self, transport):
+        """First response event of this trace written to a client"""
+        if transport not in self.delivered:
+            self.delivered.add(transport)
+            self.since('first_event', 'deliver', transport=transport)
+
+    def end(self, at=None, **attrs):
+        """Record the whole request as the root span (once)"""
+        if not self.ended:
+            self.ended = True
+            self.span('chat', self.started, at, **attrs)
+
+class Tracer:
+    """Creates traces and finds them again by id"""
+
+    def __init__(self, log=None, keep=256):
+        self.log = log or SpanLog()
+        self.keep = keep
+        # Recent traces, including ended ones whose events may still be in flight
+        self.traces = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, trace_id=None, started=None, **attrs):
+        trace = Trace(self, trace_id or uuid.uuid4().hex[:16], **attrs)
+        if started is not None:
+            # The request arrived before its handler ran
+            trace.wall -= trace.started - started
+            trace.started = started
+        with self._lock:
+            self.traces[trace.id] = trace
+            while len(self.traces) > self.keep:
+                self.traces.popitem(last=False)
+        return trace
+
+    def get(self, trace_id):
+        with self._lock:
+            return self.traces.get(trace_id)
+
+    def delivered(self, data, transport):
+        """Called as events are written to a client socket"""
+        trace_id = data.get('traceId')
+        if trace_id is not None and data.get('type') == 'response':
+            trace = self.get(trace_id)
+            if trace is not None:
+                trace.deliver(transport)
+
+tracer = Tracer()
+
+def tag(data, trace):
+    """Event data carrying the trace id, if there is a trace"""
+    return data if trace is None else trace.event(data)
+
+_profiling = threading.Lock()
+
+def sample_stacks(seconds, interval=0.005):
+    """Sample every thread for seconds; returns collapsed stacks (one per line)"""
+    if not _profiling.acquire(blocking=False):
+        raise ProfilerBusy("a profile is already running")
+    try:
+        me = threading.get_ident()
+        counts = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                counts[';'.join(reversed(stack))] += 1
+            time.sleep(interval)
+        return ''.join(f"{stack} {n}\n" for stack, n in counts.most_common())
+    finally:
+        _profiling.release()
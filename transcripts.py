@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Durable conversation transcripts for DataSenderApp
+Every user message and every response or error event is appended to a
+per-session log, so a reloaded page or a reconnecting phone can fetch the
+conversation again with GET /history?session=...&before=...&limit=...
+instead of the browser keeping all of it in the DOM.
+
+On disk each session is a directory of segments named by their first
+sequence number: NNN.log holds one JSON record per line, NNN.idx a fixed
+20-byte (seq, offset, length) entry per record. A page is a binary search
+over the memory-mapped index and one slice of the memory-mapped log per
+record, never a scan. Appends go through a background writer thread, so
+publishing an event never waits on the disk. A background compactor
+merges the streamed response chunks of a reply into one record, joins
+small closed segments and drops segments older than the retention period,
+so disk use and the number of files stay bounded.
+No external dependencies - uses only Python standard library
+"""
+
+import bisect
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+
+from async_server import DEFAULT_SESSION, json_response
+
+TRANSCRIPT_DIR = os.environ.get('TRANSCRIPT_DIR', 'transcripts')
+KEEP_DAYS = float(os.environ.get('TRANSCRIPT_KEEP_DAYS', 90))
+
+# Start a new segment once the current one is this big
+SEGMENT_BYTES = 4 * 1024 * 1024
+
+# Largest page /history serves
+MAX_PAGE = 500
+
+# seq, offset and length of one record
+ENTRY = struct.Struct('<QQI')
+
+# Event types worth keeping; status events are not
+RECORDED = ('user', 'response', 'error')
+
+class Segment:
+    """The .log/.idx pair of one segment, open for appending"""
+
+    def __init__(self, directory, first):
+        self.first = first
+        base = os.path.join(directory, f"{first:016d}")
+        self.log = open(base + '.log', 'ab')
+        self.idx = open(base + '.idx', 'ab')
+        self.size = self.log.tell()
+
+    def append(self, seq, line):
+        self.idx.write(ENTRY.pack(seq, self.size, len(line)))
+        self.log.write(line)
+        self.size += len(line)
+
+    def flush(self):
+        # The log first: a reader trusts only records the index has reached
+        self.log.flush()
+        self.idx.flush()
+
+    def close(self):
+        self.flush()
+        self.log.close()
+        self.idx.close()
+
+class SessionLog:
+    """Append state of one session's transcript"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        firsts = segment_firsts(directory)
+        self.next_seq = 1
+        self.segment = None
+        if firsts:
+            last = read_entries(directory, firsts[-1])
+            self.next_seq = (last[-1][0] + 1) if last else firsts[-1]
+            self.segment = Segment(directory, firsts[-1])
+
+    def append(self, record):
+        if self.segment is None or self.segment.size >= SEGMENT_BYTES:
+            if self.segment is not None:
+                self.segment.close()
+            self.segment = Segment(self.directory, self.next_seq)
+        record['seq'] = self.next_seq
+        self.segment.append(self.next_seq, (json.dumps(record) + '\n').encode())
+        self.next_seq += 1
+
+class TranscriptStore:
+    """Records events per session and serves pages of them"""
+
+    def __init__(self, directory=TRANSCRIPT_DIR, keep_days=KEEP_DAYS, max_open=64,
+                 max_pending=10000):
+        self.directory = directory
+        self.keep_days = keep_days
+        self.max_open = max_open
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self.logs = OrderedDict()  # session -> SessionLog, least recently written first
+        self._logs_lock = threading.Lock()  # the writer changes logs while the compactor reads it
+        self.sessions = OrderedDict()  # processId -> session, for untagged v3 events
+        self.compacted = set()  # (session directory, first seq) already compacted
+        self.forward = None  # forward(record): another process does the writing (prefork)
+        # Held while segment files are swapped, so readers never see half a swap
+        self._swap = threading.Lock()
+        self._thread = None
+
+    def start(self, compact_every=600):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._write, name="transcripts")
+        self._thread.daemon = True
+        self._thread.start()
+        compactor = threading.Thread(target=self._compact_forever, args=(compact_every,),
+                                     name="transcript-compactor")
+        compactor.daemon = True
+        compactor.start()
+        return self
+
+    def record_user(self, session, message, process_id=None, **extra):
+        """A message the user sent"""
+        record = dict(extra, type='user', session=session or DEFAULT_SESSION, message=message)
+        if process_id is not None:
+            record['processId'] = process_id
+        self.record(record)
+
+    def record_event(self, data):
+        """Bus tap: keep response and error events"""
+        if isinstance(data, dict) and data.get('type') in RECORDED:
+            self.record(data)
+
+    def record(self, data):
+        if self.forward is not None:
+            self.forward(data)
+            return
+        try:
+            self.pending.put_nowait(dict(data, ts=round(time.time(), 3)))
+        except queue.Full:
+            self.dropped += 1
+
+    def _session_of(self, data):
+        process_id = data.get('processId')
+        session = data.get('session')
+        if session is not None and process_id is not None and data['type'] == 'user':
+            self.sessions[process_id] = session
+            while len(self.sessions) > 4096:
+                self.sessions.popitem(last=False)
+        if session is None and process_id is not None:
+            # v3 tags replies with their processId only; pipelines use "pid:role"
+            session = self.sessions.get(process_id) or \
+                self.sessions.get(process_id.split(':')[0])
+        return session or DEFAULT_SESSION
+
+    def _write(self):
+        while True:
+            batch = [self.pending.get()]
+            while True:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            touched = set()
+            for data in batch:
+                session = self._session_of(data)
+                try:
+                    log = self._log(session)
+                    log.append({k: v for k, v in data.items() if k != 'session'})
+                    touched.add(log)
+                except (OSError, ValueError) as e:
+                    print(f"Transcript {session} failed: {e}", flush=True)
+            for log in touched:
+                try:
+                    log.segment.flush()
+                except OSError as e:
+                    print(f"Transcript flush failed: {e}", flush=True)
+
+    def _log(self, session):
+        with self._logs_lock:
+            log = self.logs.get(session)
+            if log is None:
+                log = self.logs[session] = SessionLog(self.session_dir(session))
+                while len(self.logs) > self.max_open:
+                    _, oldest = self.logs.popitem(last=False)
+                    if oldest.segment is not None:
+                        oldest.segment.close()
+            self.logs.move_to_end(session)
+            return log
+
+    def session_dir(self, session):
+        # Quoted so that no session id can name a path outside the directory
+        return os.path.join(self.directory, quote(session, safe='').replace('.', '%2E')[:200])
+
+    def page(self, session, before=None, limit=50):
+        """Up to limit records older than seq before (default: the newest), oldest first"""
+        for attempt in range(2):
+            try:
+                records = self._read_page(self.session_dir(session), before, limit)
+                break
+            except (OSError, ValueError):
+                # A compaction in another process swapped files under us; once more
+                if attempt:
+                    raise
+        more = bool(records) and records[0]['seq'] > 1 and len(records) == limit
+        return {'session': session, 'messages': records,
+                'before': records[0]['seq'] if more else None}
+
+    def _read_page(self, directory, before, limit):
+        with self._swap:
+            segments = [open_segment(directory, first)
+                        for first in reversed(segment_firsts(directory))]
+        records = []
+        try:
+            for segment in segments:
+                if segment is None:
+                    continue
+                idx, log, count = segment
+                # Binary search on seq without reading the whole index
+                end = count if before is None else bisect.bisect_left(_SeqView(idx, count),
+                                                                      before)
+                for n in range(end - 1, -1, -1):
+                    if len(records) >= limit:
+                        break
+                    _, offset, length = ENTRY.unpack_from(idx, n * ENTRY.size)
+                    records.append(json.loads(log[offset:offset + length]))
+                if len(records) >= limit:
+                    break
+        finally:
+            for segment in segments:
+                if segment is not None:
+                    segment[0].close()
+                    segment[1].close()
+        records.reverse()
+        return records
+
+    async def handle_history(self, request):
+        """GET /history?session=...&before=<seq>&limit=<n>"""
+        query = request.query
+        try:
+            before = int(query['before']) if query.get('before') else None
+            limit = max(1, min(int(query.get('limit', 50)), MAX_PAGE))
+        except ValueError:
+            return json_response({'status': 'error', 'message': 'before and limit are numbers'},
+                                 400)
+        session = query.get('session') or DEFAULT_SESSION
+        return await request.server.loop.run_in_executor(None, self.page, session, before,
+                                                          limit)
+
+    def _compact_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Transcript compaction failed: {e}", flush=True)
+
+    def compact(self):
+        """Expire, merge and join the closed segments of every session"""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            directory = os.path.join(self.directory, name)
+            if os.path.isdir(directory):
+                self._compact_session(directory)
+
+    def _compact_session(self, directory):
+        firsts = segment_firsts(directory)
+        cutoff = time.time() - self.keep_days * 86400
+        with self._logs_lock:
+            open_dirs = {log.directory for log in self.logs.values()}
+        if firsts and directory not in open_dirs and \
+                os.path.getmtime(os.path.join(directory, f"{firsts[-1]:016d}.log")) < cutoff:
+            # Nothing written for the whole retention period: forget the session
+            firsts.append(None)
+        # Every segment but the newest is closed: the writer only appends to the newest
+        closed = firsts[:-1]
+        run = []
+        run_size = 0
+        for first in closed:
+            base = os.path.join(directory, f"{first:016d}")
+            if os.path.getmtime(base + '.log') < cutoff:
+                with self._swap:
+                    for suffix in ('.log', '.idx'):
+                        os.remove(base + suffix)
+                self.compacted.discard((directory, first))
+                continue
+            if (directory, first) not in self.compacted:
+                self._merge_chunks(directory, first)
+            size = os.path.getsize(base + '.log')
+            # Join runs of small segments so the file count stays low
+            if run and run_size + size > SEGMENT_BYTES:
+                self._join(directory, run)
+                run, run_size = [], 0
+            run.append(first)
+            run_size += size
+        if run:
+            self._join(directory, run)
+        if not segment_firsts(directory):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+
+    def _merge_chunks(self, directory, first):
+        """Rewrite a segment with each reply's response chunks as one record"""
+        records = read_records(directory, first)
+        merged = []
+        for record in records:
+            last = merged[-1] if merged else None
+            if last is not None and record.get('type') == last.get('type') == 'response' \
+                    and record.get('processId') == last.get('processId') \
+                    and record.get('agent') == last.get('agent'):
+                # Chunks are pieces of one text, not lines
+                last['message'] = last['message'] + record.get('message', '')
+                continue
+            merged.append(record)
+        if len(merged) < len(records):
+            self._rewrite(directory, first, merged, [first])
+        self.compacted.add((directory, first))
+
+    def _join(self, directory, firsts):
+        if len(firsts) < 2:
+            return
+        records = []
+        for first in firsts:
+            records += read_records(directory, first)
+        self._rewrite(directory, firsts[0], records, firsts)
+        self.compacted.add((directory, firsts[0]))
+
+    def _rewrite(self, directory, first, records, replaced):
+        """Write records as segment first, replacing the segments in replaced"""
+        base = os.path.join(directory, f"{first:016d}")
+        offset = 0
+        with open(base + '.log.tmp', 'wb') as log, open(base + '.idx.tmp', 'wb') as idx:
+            for record in records:
+                line = (json.dumps(record) + '\n').encode()
+                idx.write(ENTRY.pack(record['seq'], offset, len(line)))
+                log.write(line)
+                offset += len(line)
+            log.flush()
+            os.fsync(log.fileno())
+            idx.flush()
+            os.fsync(idx.fileno())
+        with self._swap:
+            for other in replaced:
+                if other != first:
+                    other_base = os.path.join(directory, f"{other:016d}")
+                    for suffix in ('.log', '.idx'):
+                        os.remove(other_base + suffix)
+                    self.compacted.discard((directory, other))
+            os.replace(base + '.log.tmp', base + '.log')
+            os.replace(base + '.idx.tmp', base + '.idx')
+
+    def stats(self):
+        return {'pending': self.pending.qsize(), 'dropped': self.dropped,
+                'open': len(self.logs)}
+
+class _SeqView:
+    """The seq column of a mapped index, as a sequence for bisect"""
+
+    def __init__(self, idx, count):
+        self.idx = idx
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, n):
+        return ENTRY.unpack_from(self.idx, n * ENTRY.size)[0]
+
+def segment_firsts(directory):
+    """First seq of every segment in a session directory, in order"""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[:-4]) for name in names
+                  if name.endswith('.idx') and name[:-4].isdigit())
+
+def open_segment(directory, first):
+    """(index mmap, log mmap, entries) of a segment; None while it is empty"""
+    base = os.path.join(directory, f"{first:016d}")
+    with open(base + '.idx', 'rb') as idx_file, open(base + '.log', 'rb') as log_file:
+        idx_size = os.fstat(idx_file.fileno()).st_size
+        log_size = os.fstat(log_file.fileno()).st_size
+        if idx_size < ENTRY.size or not log_size:
+            return None
+        idx = mmap.mmap(idx_file.fileno(), 0, access=mmap.ACCESS_READ)
+        log = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+    # Only whole entries, and only those whose record has reached the log
+    count = idx_size // ENTRY.size
+    while count and sum(ENTRY.unpack_from(idx, (count - 1) * ENTRY.size)[1:]) > log_size:
+        count -= 1
+    return idx, log, count
+
+def read_entries(directory, first):
+    """Every (seq, offset, length) entry of a segment"""
+    with open(os.path.join(directory, f"{first:016d}.idx"), 'rb') as f:
+        data = f.read()
+    return [ENTRY.unpack_from(data, n) for n in range(0, len(data) - ENTRY.size + 1,
+                                                      ENTRY.size)]
+
+def read_records(directory, first):
+    """Every record of a (closed) segment"""
+    with open(os.path.join(directory, f"{first:016d}.log"), 'rb') as f:
+        log = f.read()
+    return [json.loads(log[offset:offset + length])
+            for _, offset, length in read_entries(directory, first)]
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Streaming uploads into a CLI's stdin
+The event loop reads a request body in fixed-size chunks and hands them
+to the worker thread that owns the CLI process through a small bounded
+queue. A slow CLI blocks the worker's write, the queue fills, the loop
+stops reading the socket and TCP flow control pushes back on the client,
+so an upload of any size holds at most depth x chunk_size bytes here.
+No external dependencies - uses only Python standard library
+"""
+
+import asyncio
+import codecs
+import os
+import queue
+import threading
+import time
+
+CHUNK_SIZE = 64 * 1024
+
+# Largest upload accepted
+MAX_UPLOAD = int(os.environ.get('MAX_UPLOAD_MB', 64)) * 1024 * 1024
+
+# Give up when the CLI, once started, takes no input for this long
+STALL_TIMEOUT = float(os.environ.get('UPLOAD_STALL_TIMEOUT', 60))
+
+class UploadTooLarge(Exception):
+    """The body went over the upload limit"""
+
+class UploadAborted(Exception):
+    """The upload stopped before the end of the body"""
+
+class UploadStalled(UploadAborted):
+    """The CLI took no input for the stall timeout"""
+
+class Upload:
+    """One request body on its way from the event loop to a CLI's stdin"""
+
+    def __init__(self, prefix='', depth=4, stopped=None, stall_timeout=STALL_TIMEOUT):
+        self.prefix = prefix  # written before the body, e.g. an instruction
+        self.chunks = queue.Queue(maxsize=depth)  # bytes, then None at the end
+        self.stopped = stopped or (lambda: False)  # e.g. the run was interrupted or failed
+        self.stall_timeout = stall_timeout
+        self.received = 0
+        self.aborted = False
+        self.stalled = False
+        self.started = threading.Event()  # a worker is copying the upload into a CLI
+
+    async def feed(self, body, limit=MAX_UPLOAD, progress=None, chunk_size=CHUNK_SIZE):
+        """Copy a BodyStream into the queue; progress(received) after each chunk
+
+        Raises UploadTooLarge, UploadStalled, UploadAborted, or the
+        connection's error; the upload is aborted in every case.
+        """
+        try:
+            while True:
+                chunk = await body.read(chunk_size)
+                if chunk:
+                    self.received += len(chunk)
+                    if self.received > limit:
+                        raise UploadTooLarge(f"upload over {limit} bytes")
+                if not await self._put(chunk or None):
+                    if self.stalled:
+                        raise UploadStalled(f"no input taken for {self.stall_timeout:g} s")
+                    raise UploadAborted("upload stopped")
+                if not chunk:
+                    return self.received
+                if progress is not None:
+                    progress(self.received)
+        except BaseException:
+            self.abort()
+            raise
+
+    async def _put(self, item):
+        if self.aborted or self.stopped():
+            return False
+        try:
+            self.chunks.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+        # Still queued for a worker: waiting there is not a stall, and it would
+        # hold an executor thread for as long as the queue is long
+        while not self.started.is_set():
+            await asyncio.sleep(0.1)
+            if self.aborted or self.stopped():
+                return False
+        # The CLI is behind: wait off the loop, which stops reading the socket
+        return await asyncio.get_running_loop().run_in_executor(None, self._put_blocking, item)
+
+    def _put_blocking(self, item):
+        deadline = time.monotonic() + self.stall_timeout
+        while not (self.aborted or self.stopped()):
+            if time.monotonic() >= deadline:
+                self.stalled = True
+                return False
+            try:
+                self.chunks.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def abort(self):
+        """Stop both sides: feed() raises, and write_to() raises once the queue is empty"""
+        self.aborted = True
+
+    def write_to(self, stdin):
+        """Copy the upload into a text-mode stdin (worker thread); blocks on the CLI"""
+        self.started.set()
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        if self.prefix:
+            stdin.write(self.prefix)
+        while True:
+            try:
+                chunk = self.chunks.get(timeout=0.5)
+            except queue.Empty:
+                if self.aborted:
+                    raise UploadAborted(f"upload stopped after {self.received} bytes")
+                continue
+            if chunk is None:
+                stdin.write(decoder.decode(b'', final=True))
+                return
+            stdin.write(decoder.decode(chunk))
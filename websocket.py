@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+WebSocket endpoint (RFC 6455) for DataSenderApp
+One persistent full-duplex connection carries chat messages, interrupts
+and the streamed output, so the page no longer needs a /chat POST per
+message. Supports text and binary frames, fragmentation, ping/pong and
+optional permessage-deflate (RFC 7692).
+No external dependencies - uses only Python standard library
+
+Client -> server (JSON, text or binary frame):
+    {"type": "chat", "message": "...", "processId": "...", "session": "..."}
+    {"type": "interrupt", "processId": "..."}
+Server -> client: the same JSON events as /events, plus
+    {"type": "ack", "request": "chat", ...the /chat response...}
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import zlib
+
+from async_server import (BadRequest, Request, Response, DEFAULT_SESSION, EVENT_CLIENTS,
+                          STREAMED_BYTES, start_response)
+import tracing
+
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+MAX_MESSAGE = 1024 * 1024
+
+# Opcodes
+CONTINUATION, TEXT, BINARY, CLOSE, PING, PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+# Client message types and the HTTP routes that handle them
+ROUTES = {
+    'chat': '/chat',
+    'interrupt': '/interrupt',
+}
+
+class ProtocolError(Exception):
+    def __init__(self, code, reason):
+        super().__init__(reason)
+        self.code = code
+
+class WebSocket:
+    """Frame reader/writer over an accepted asyncio stream"""
+
+    def __init__(self, reader, writer, deflate=False):
+        self.reader = reader
+        self.writer = writer
+        self.deflate = deflate
+        # Both directions keep their compression context between messages
+        self._compress = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        self._decompress = zlib.decompressobj(-15)
+        self.closed = False
+
+    def send(self, payload, opcode=TEXT):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        first = 0x80 | opcode
+        # Small frames are not worth compressing
+        if self.deflate and opcode in (TEXT, BINARY) and len(payload) > 64:
+            payload = self._compress.compress(payload) + self._compress.flush(zlib.Z_SYNC_FLUSH)
+            payload = payload[:-4]  # drop the 00 00 ff ff tail (RFC 7692 7.2.1)
+            first |= 0x40
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', first, length)
+        elif length < 65536:
+            header = struct.pack('!BBH', first, 126, length)
+        else:
+            header = struct.pack('!BBQ', first, 127, length)
+        # One write per frame, so frames from different coroutines never interleave
+        self.writer.write(header + payload)
+        STREAMED_BYTES.inc(len(header) + length, transport='ws')
+
+    def send_json(self, data):
+        self.send(json.dumps(data))
+
+    async def _read_frame(self):
+        first, second = await self.reader.readexactly(2)
+        fin = first & 0x80
+        compressed = first & 0x40
+        opcode = first & 0x0F
+        if not second & 0x80:
+            raise ProtocolError(1002, 'client frames must be masked')
+        length = second & 0x7F
+        if length == 126:
+            length, = struct.unpack('!H', await self.reader.readexactly(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', await self.reader.readexactly(8))
+        if length > MAX_MESSAGE:
+            raise ProtocolError(1009, 'message too big')
+        mask = await self.reader.readexactly(4)
+        payload = await self.reader.readexactly(length)
+        if length:
+            # XOR with the repeating 4-byte mask, done on big integers for speed
+            key = int.from_bytes((mask * (length // 4 + 1))[:length], 'big')
+            payload = (int.from_bytes(payload, 'big') ^ key).to_bytes(length, 'big')
+        return fin, compressed, opcode, payload
+
+    async def receive(self):
+        """Next complete data message as (opcode, bytes); None once closed"""
+        fragments = []
+        message_opcode = None
+        message_compressed = False
+        while True:
+            fin, compressed, opcode, payload = await self._read_frame()
+
+            if opcode == PING:
+                self.send(payload, PONG)
+                continue
+            if opcode == PONG:
+                continue
+            if opcode == CLOSE:
+                self.close(1000 if len(payload) < 2 else struct.unpack('!H', payload[:2])[0])
+                return None
+
+            if opcode == CONTINUATION:
+                if message_opcode is None:
+                    raise ProtocolError(1002, 'unexpected continuation frame')
+            elif opcode in (TEXT, BINARY):
+                if message_opcode is not None:
+                    raise ProtocolError(1002, 'expected continuation frame')
+                message_opcode = opcode
+                message_compressed = bool(compressed) and self.deflate
+            else:
+                raise ProtocolError(1002, f'unknown opcode {opcode}')
+
+            fragments.append(payload)
+            if sum(len(f) for f in fragments) > MAX_MESSAGE:
+                raise ProtocolError(1009, 'message too big')
+            if fin:
+                data = b''.join(fragments)
+                if message_compressed:
+                    data = self._decompress.decompress(data + b'\x00\x00\xff\xff', MAX_MESSAGE)
+                    if self._decompress.unconsumed_tail:
+                        raise ProtocolError(1009, 'message too big')
+                return message_opcode, data
+
+    def close(self, code=1000, reason=''):
+        if not self.closed:
+            self.closed = True
+            self.send(struct.pack('!H', code) + reason.encode(), CLOSE)
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + GUID).encode()).digest()).decode()
+
+def offers_deflate(headers):
+    offers = headers.get('sec-websocket-extensions', '')
+    return any(offer.split(';')[0].strip() == 'permessage-deflate'
+               for offer in offers.split(','))
+
+async def serve_websocket(request):
+    """GET /ws: upgrade, then run chat, interrupts and output over one socket"""
+    server = request.server
+    key = request.headers.get('sec-websocket-key')
+    if request.headers.get('upgrade', '').lower() != 'websocket' or not key:
+        return Response(b'Expected a WebSocket upgrade', 400, 'text/plain')
+
+    deflate = offers_deflate(request.headers)
+    headers = [
+        ('Upgrade', 'websocket'),
+        ('Connection', 'Upgrade'),
+        ('Sec-WebSocket-Accept', accept_key(key)),
+    ]
+    if deflate:
+        headers.append(('Sec-WebSocket-Extensions', 'permessage-deflate'))
+    start_response(request.writer, 101, headers)
+    server.log(request, 101)
+    print("Client connected to /ws", flush=True)
+
+    ws = WebSocket(request.reader, request.writer, deflate)
+    session = request.query.get('session', DEFAULT_SESSION)
+    last_id = request.query.get('lastEventId')
+    sub = server.events.subscribe(int(last_id) if last_id and last_id.isdigit() else None,
+                                  session=session, agent=request.query.get('agent'))
+
+    async def forward_events():
+        if server.greeting:
+            ws.send_json(server.greeting)
+        while not ws.closed:
+            try:
+                await asyncio.wait_for(sub.wait(), server.heartbeat)
+            except asyncio.TimeoutError:
+                ws.send(b'', PING)
+                await request.writer.drain()
+                continue
+            if sub.dropped:
+                ws.close(1008, 'too slow')
+                break
+            for _, data in sub.drain():
+                ws.send_json(data)
+                tracing.tracer.delivered(data, 'ws')
+            await request.writer.drain()
+
+    # Only the forwarder drains the writer; concurrent drain() calls are unsafe
+    forwarder = asyncio.ensure_future(forward_events())
+    EVENT_CLIENTS.inc(transport='ws')
+    try:
+        while True:
+            message = await ws.receive()
+            if message is None:
+                break
+            await handle_message(server, request, ws, session, message[1])
+    except ProtocolError as e:
+        ws.close(e.code, str(e))
+    except zlib.error as e:
+        ws.close(1007, str(e))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        EVENT_CLIENTS.dec(transport='ws')
+        forwarder.cancel()
+        await asyncio.gather(forwarder, return_exceptions=True)
+        server.events.unsubscribe(sub)
+        try:
+            await request.writer.drain()
+        except ConnectionError:
+            pass
+    return None
+
+async def handle_message(server, request, ws, session, payload):
+    """Run a client message through the matching HTTP route handler"""
+    try:
+        data = json.loads(payload)
+        path = ROUTES[data.get('type')]
+    except (ValueError, KeyError, AttributeError):
+        ws.send_json({'type': 'error', 'message': 'unsupported message'})
+        return
+
+    data.setdefault('session', session)
+    inner = Request('POST', path, 'HTTP/1.1', request.headers, request.reader, request.writer)
+    inner.body = json.dumps(data).encode()
+    try:
+        response = await server.dispatch(inner)
+    except BadRequest as e:
+        ws.send_json({'type': 'error', 'request': data['type'], 'code': 400, 'message': str(e)})
+        return
+    except Exception as e:
+        # The socket stays open; an HTTP 500 written here would corrupt the stream
+        print(f"Error handling WebSocket {data['type']}: {e}", flush=True)
+        ws.send_json({'type': 'error', 'request': data['type'], 'code': 500, 'message': str(e)})
+        return
+    try:
+        result = json.loads(response.body) if response.body else {}
+    except ValueError:
+        result = {}
+    ws.send_json(dict(result, type='ack', request=data['type'], code=response.status))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Pre-warmed Claude CLI worker pool for print mode
+Keeps a few `claude --print` processes spawned ahead of time, waiting on
+stdin, so process start-up is off the critical path. Messages wait in a
+bounded admission queue and run on a fixed number of worker threads, so a
+burst of requests can never fork an unbounded number of CLI processes.
+The queue is a Scheduler (scheduler.py): fair between clients, with
+priority lanes, and queued work can be cancelled.
+"""
+
+import atexit
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import deque
+
+import metrics
+import supervisor
+from scheduler import Scheduler, INTERACTIVE
+
+# Point this at a stub (e.g. stub_claude.py) to run without the real CLI
+CLAUDE_BIN = os.environ.get('CLAUDE_BIN', 'claude')
+
+class PoolFull(Exception):
+    """The admission queue is full"""
+
+class WorkerPool:
+    """Runs target(proc, *args) on a warm `claude --print` process"""
+
+    def __init__(self, target, warm=2, max_workers=4, max_queue=32,
+                 max_idle=300, command=None, scheduler=None):
+        self.target = target
+        self.warm = warm
+        self.max_workers = max_workers
+        self.max_idle = max_idle
+        self.command = command or [CLAUDE_BIN, '--print']
+        # Without a scheduler: fair between clients but no rate limits
+        self.jobs = scheduler or Scheduler(maxsize=max_queue, rate=0)
+        self.ready = deque()  # (spawned_at, proc) waiting on stdin
+        self.busy = 0
+        self.running = set()  # processes handed to target()
+        self.spawned = 0
+        self.cold_starts = 0
+        self._cond = threading.Condition()
+        self._running = False
+
+    def start(self):
+        self._running = True
+        for i in range(self.max_workers):
+            thread = threading.Thread(target=self._work, name=f"pool-worker-{i}")
+            thread.daemon = True
+            thread.start()
+        thread = threading.Thread(target=self._replenish, name="pool-replenish")
+        thread.daemon = True
+        thread.start()
+        atexit.register(self.shutdown)
+        metrics.gauge('datasender_to_claude_depth', 'Messages waiting for a CLI process',
+                      function=self.jobs.qsize)
+        metrics.gauge('datasender_active_processes', 'CLI processes working on a message',
+                      function=lambda: len(self.running))
+        metrics.gauge('claude_process_rss_bytes', 'Resident memory of each CLI process',
+                      ('pid', 'owner'), function=self.rss)
+        return self
+
+    def submit(self, *args, client=None, lane=INTERACTIVE, job_id=None, cost=1, limit=True):
+        """Queue a job; raises PoolFull instead of growing without bound
+
+        The scheduler may also raise RateLimited for this client.
+        """
+        try:
+            self.jobs.put_nowait(args, client, lane, job_id, cost, limit)
+        except queue.Full:
+            raise PoolFull(f"{self.jobs.qsize()} messages already waiting")
+
+    def cancel(self, job_id):
+        """Drop a job that has not started yet; False if it already has"""
+        return self.jobs.cancel(job_id)
+
+    def spawn(self):
+        started = time.monotonic()
+        proc = supervisor.spawn(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True
+        )
+        # Kept on the process so a trace can tell a cold start from a warm one
+        proc.spawn_times = (started, time.monotonic())
+        metrics.SPAWN_SECONDS.observe(proc.spawn_times[1] - started, mode='print')
+        self.spawned += 1
+        return proc
+
+    def acquire(self):
+        """Take a warm process, falling back to a cold spawn"""
+        with self._cond:
+            while self.ready:
+                _, proc = self.ready.popleft()
+                if proc.poll() is None:
+                    self._cond.notify_all()  # wake the replenisher
+                    return proc
+        self.cold_starts += 1
+        return self.spawn()
+
+    def _work(self):
+        while self._running:
+            args = self.jobs.get()
+            if args is None:
+                break
+            with self._cond:
+                self.busy += 1
+            proc = None
+            try:
+                proc = self.acquire()
+                with self._cond:
+                    self.running.add(proc)
+                self.target(proc, *args)
+            except Exception as e:
+                print(f"Worker pool job failed: {e}", flush=True)
+            finally:
+                with self._cond:
+                    self.busy -= 1
+                    self.running.discard(proc)
+
+    def _replenish(self):
+        # Sleeps until a warm process is taken (or the oldest one goes stale)
+        while self._running:
+            with self._cond:
+                while self._running and len(self.ready) >= self.warm:
+                    oldest = self.ready[0][0]
+                    if time.monotonic() - oldest > self.max_idle:
+                        _, stale = self.ready.popleft()
+                        supervisor.kill(stale)
+                        stale.wait()
+                        break
+                    self._cond.wait(self.max_idle)
+                if not self._running:
+                    break
+            try:
+                proc = self.spawn()
+            except OSError as e:
+                print(f"Could not pre-spawn {self.command[0]}: {e}", flush=True)
+                time.sleep(5)
+                continue
+            with self._cond:
+                if not self._running:
+                    supervisor.kill(proc)
+                    proc.wait()
+                    break
+                self.ready.append((time.monotonic(), proc))
+
+    def shutdown(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+            while self.ready:
+                _, proc = self.ready.popleft()
+                supervisor.kill(proc)
+                proc.wait()
+        self.jobs.close()
+
+    def is_ready(self):
+        """A CLI process has started, so a message will not wait for a spawn"""
+        with self._cond:
+            return bool(self.ready or self.running)
+
+    def rss(self):
+        """{(pid, owner): bytes} for warm and running processes"""
+        with self._cond:
+            procs = [(proc, 'warm') for _, proc in self.ready]
+            procs += [(proc, 'running') for proc in self.running]
+        sizes = {}
+        for proc, owner in procs:
+            size = metrics.process_rss(proc.pid)
+            if size is not None:
+                sizes[(proc.pid, owner)] = size
+        return sizes
+
+    def stats(self):
+        with self._cond:
+            return {
+                'warm': len(self.ready),
+                'busy': self.busy,
+                'queued': self.jobs.qsize(),
+                'spawned': self.spawned,
+                'cold_starts': self.cold_starts,
+            }